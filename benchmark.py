@@ -0,0 +1,325 @@
+"""Benchmarks do Material Checker Pro
+
+Gera catálogos e históricos sintéticos e mede as operações principais do
+sistema em cada tamanho. O resultado é gravado em JSON para comparar versões:
+
+    python benchmark.py --sizes 10000 100000 --out resultados.json
+    python benchmark.py --sizes 10000 --compare resultados.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import sistema
+
+# Distribuições aproximadas dos catálogos reais
+ETAPA_PREFIXES = ['PRE', 'VCU', 'RET SR', 'RET', 'ENS', 'MUL']
+ETAPA_REGIONS = ['Sul', 'Norte', 'Centro', 'Oeste', 'Leste', 'Cerrado']
+AVANCO_VALUES = ['Sim', 'Não']
+AVANCO_WEIGHTS = [0.35, 0.65]
+TRAIT_VALUES = ['CE3', 'E3', 'CONV', '']
+TRAIT_WEIGHTS = [0.3, 0.3, 0.25, 0.15]
+
+# Termos da busca: etapas, trechos curtos e longos de ID e sem resultado
+SEARCH_TERMS = ['VCU', 'sul', '12', '0042', '98765', 'zzz']
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+DEFAULT_FORMATS = ['xlsx', 'parquet']
+# Gerar xlsx acima disso é lento demais para uma rodada comum
+XLSX_MAX_ROWS = 200000
+
+
+def generate_catalog(n_rows, seed=0):
+    """Catálogo sintético com etapas, avanços e traits realistas"""
+    rng = np.random.default_rng(seed)
+    etapas = [f"{prefix} {region}" for prefix in ETAPA_PREFIXES
+              for region in ETAPA_REGIONS]
+    # Poucas etapas concentram a maior parte dos materiais
+    etapa_weights = rng.pareto(1.5, len(etapas)) + 0.1
+    etapa_weights /= etapa_weights.sum()
+    return pd.DataFrame({
+        'etapa_programa': rng.choice(etapas, n_rows, p=etapa_weights),
+        'id_codigo': [f"{i:08d}" for i in rng.permutation(n_rows)],
+        'avanco': rng.choice(AVANCO_VALUES, n_rows, p=AVANCO_WEIGHTS),
+        'trait': rng.choice(TRAIT_VALUES, n_rows, p=TRAIT_WEIGHTS)
+    })
+
+
+def generate_history(catalog, n_records, seed=0, missing_rate=0.05):
+    """Histórico sintético de checagens no formato do sistema"""
+    rng = np.random.default_rng(seed)
+    rows = catalog.iloc[rng.integers(0, len(catalog), n_records)]
+    start = datetime(2025, 1, 6, 7, 0, 0)
+    times = [(start + timedelta(seconds=int(s))).strftime(sistema.CHECK_TIME_FORMAT)
+             for s in np.sort(rng.integers(0, 10 * 3600, n_records))]
+    missing = rng.random(n_records) < missing_rate
+    ids = rows['id_codigo'].to_numpy(dtype=object)
+    ids[missing] = [f"X{i:07d}" for i in range(int(missing.sum()))]
+    history = pd.DataFrame({
+        'id_codigo': ids,
+        'etapa_programa': np.where(missing, 'N/A', rows['etapa_programa']),
+        'trait': np.where(missing, 'N/A', rows['trait']),
+        'avanco': np.where(missing, 'N/A', rows['avanco']),
+        'encontrado': np.where(missing, 'Não', np.where(
+            rows['avanco'] == 'Sim', 'Sim', 'Não - Avanço incorreto')),
+        'check_time': times
+    })
+    return history[sistema.HISTORY_COLUMNS].to_dict('records')
+
+
+def write_catalog(df, path):
+    """Grava o catálogo sintético no formato indicado pela extensão"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.xlsx':
+        df.to_excel(path, index=False, engine='xlsxwriter')
+    elif ext == '.csv':
+        df.to_csv(path, index=False)
+    elif ext == '.parquet':
+        df.to_parquet(path, index=False)
+    elif ext == '.feather':
+        df.to_feather(path)
+    else:
+        raise ValueError(f"Formato não suportado: {ext}")
+
+
+def measure(func, repeat):
+    """Executa func repetidamente e devolve as durações (s)"""
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - started)
+    return runs
+
+
+def reset_catalog_caches():
+    """Descarta os caches de catálogo (memória e Parquet em disco)"""
+    sistema.cached_catalog_entry.clear()
+    if os.path.isdir(sistema.PARQUET_CACHE_DIR):
+        for name in os.listdir(sistema.PARQUET_CACHE_DIR):
+            os.remove(os.path.join(sistema.PARQUET_CACHE_DIR, name))
+
+
+def reset_session(df, quick_avanco):
+    """Estado mínimo da sessão usado pelo process_scan (sem filtro)"""
+    # Journal vazio a cada tamanho: leituras de rodadas anteriores não
+    # antecipam a compactação para dentro das leituras medidas
+    sistema.clear_cache()
+    sistema._journal_state['entries'] = 0
+    state = sistema.st.session_state
+    state.check_history = sistema.HistoryStore()
+    state.scan_counters = sistema.new_scan_counters()
+    state.history_version = 0
+    state.last_processed = ""
+    state.current_quick_avanco = quick_avanco
+    state.current_filtered_df = df
+    state.current_catalog_df = df
+    state.current_scope = None
+    state.catalog_id_index = sistema.build_id_index(df)
+    state.duplicate_policy = sistema.DEFAULT_DUPLICATE_POLICY
+    state.station_id = 'benchmark'
+
+
+def bench_catalog(path, repeat):
+    """Carga, validação e filtros de um arquivo de catálogo"""
+    results = {}
+
+    def cold_load():
+        reset_catalog_caches()
+        sistema.load_excel_file(sistema.open_catalog_source(path))
+
+    results['load_excel_file (frio)'] = measure(cold_load, repeat)
+
+    def parquet_load():
+        sistema.cached_catalog_entry.clear()
+        sistema.load_excel_file(sistema.open_catalog_source(path))
+
+    results['load_excel_file (cache parquet)'] = measure(parquet_load, repeat)
+    # Mesmo caminho de um rerun do app: catálogo no st.cache_resource
+    results['load_excel_file (cache memória)'] = measure(
+        lambda: sistema.load_excel_file(sistema.open_catalog_source(path)), repeat)
+    return results
+
+
+def bench_operations(df, history, n_scans, repeat, seed=0):
+    """Validação, filtros, leituras, relatório e cache para um catálogo"""
+    results = {}
+    state = sistema.st.session_state
+    partition = sistema.build_avanco_partition(df)
+
+    results['validate_excel_data'] = measure(
+        lambda: sistema.validate_excel_data(df), repeat)
+    results['filter_materials (avanço)'] = measure(
+        lambda: sistema.filter_materials(df, 'Sim', None, partition),
+        repeat)
+
+    # O índice de busca guarda os resultados por termo: cada repetição usa
+    # um índice novo (construído fora da medição) e termos ainda não vistos
+    results['CatalogSearchIndex (construção)'] = measure(
+        lambda: sistema.CatalogSearchIndex(df).search(''), repeat)
+    search_runs = []
+    for _ in range(repeat):
+        search_index = sistema.CatalogSearchIndex(df)
+        search_index.search('')
+        for term in SEARCH_TERMS:
+            started = time.perf_counter()
+            sistema.filter_materials(df, None, term, partition, search_index)
+            search_runs.append(time.perf_counter() - started)
+    results['filter_materials (busca)'] = search_runs
+
+    # Leituras individuais: mistura de encontrados, avanço incorreto e ausentes
+    rng = np.random.default_rng(seed)
+    codes = df['id_codigo'].astype(str).to_numpy()[
+        rng.integers(0, len(df), n_scans)].tolist()
+    codes[::20] = [f"X{i}" for i in range(len(codes[::20]))]
+    reset_session(df, 'Sim')
+    scan_runs = []
+    for code in codes:
+        state.scanner_input = code
+        started = time.perf_counter()
+        sistema.process_scan()
+        scan_runs.append(time.perf_counter() - started)
+    results['process_scan'] = scan_runs
+
+    store = sistema.HistoryStore(history)
+    results['export_report'] = measure(
+        lambda: sistema.export_report(df, store), repeat)
+
+    snapshot = {'timestamp': datetime.now().isoformat(),
+                'total_items': len(history), 'history': history}
+    results['save_to_cache'] = measure(
+        lambda: sistema.save_to_cache(snapshot), repeat)
+    results['load_from_cache'] = measure(sistema.load_from_cache, repeat)
+    return results
+
+
+def summarize(runs):
+    """Estatísticas de uma lista de durações (s)"""
+    samples = np.asarray(runs)
+    return {
+        'runs': len(samples),
+        'min_s': float(samples.min()),
+        'median_s': float(np.median(samples)),
+        'p95_s': float(np.percentile(samples, 95)),
+        'max_s': float(samples.max())
+    }
+
+
+def environment_info():
+    """Versões e revisão do código, para comparar resultados"""
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        revision = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': revision or None,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform()
+    }
+
+
+def run_benchmarks(sizes, formats, history_size, n_scans, repeat, seed=0):
+    """Executa a suíte completa e devolve os resultados"""
+    results = []
+    for size in sizes:
+        df = generate_catalog(size, seed)
+        history = generate_history(df, history_size, seed)
+
+        for fmt in formats:
+            if fmt == 'xlsx' and size > XLSX_MAX_ROWS:
+                print(f"  {size:>9} {fmt:<8} ignorado (acima de {XLSX_MAX_ROWS} linhas)")
+                continue
+            path = os.path.abspath(f"catalogo_{size}.{fmt}")
+            write_catalog(df, path)
+            for operation, runs in bench_catalog(path, repeat).items():
+                results.append({'size': size, 'format': fmt,
+                                'operation': operation, **summarize(runs)})
+                print(f"  {size:>9} {fmt:<8} {operation:<34} "
+                      f"{results[-1]['median_s'] * 1000:10.2f} ms")
+            os.remove(path)
+
+        # Demais operações usam o catálogo normalizado, como na aplicação
+        normalized = sistema.normalize_catalog(df.copy())
+        for operation, runs in bench_operations(
+                normalized, history, n_scans, repeat, seed).items():
+            results.append({'size': size, 'format': None,
+                            'operation': operation, **summarize(runs)})
+            print(f"  {size:>9} {'-':<8} {operation:<34} "
+                  f"{results[-1]['median_s'] * 1000:10.2f} ms")
+    return results
+
+
+def compare_results(results, baseline_path):
+    """Mostra a razão entre as medianas atuais e as de uma execução anterior"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(r['size'], r['format'], r['operation']): r['median_s']
+                for r in baseline['results']}
+    print(f"\nComparação com {baseline_path} "
+          f"(revisão {baseline['environment'].get('revision')}):")
+    for r in results:
+        before = previous.get((r['size'], r['format'], r['operation']))
+        if before:
+            ratio = r['median_s'] / before
+            flag = '⚠️' if ratio > 1.2 else ''
+            print(f"  {r['size']:>9} {r['format'] or '-':<8} {r['operation']:<34} "
+                  f"{ratio:6.2f}x {flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Tamanhos de catálogo (linhas)")
+    parser.add_argument("--formats", nargs="+", default=DEFAULT_FORMATS,
+                        choices=['xlsx', 'csv', 'parquet', 'feather'])
+    parser.add_argument("--history", type=int, default=20000,
+                        help="Registros no histórico sintético")
+    parser.add_argument("--scans", type=int, default=500,
+                        help="Leituras individuais medidas por tamanho")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--compare", help="JSON de uma execução anterior")
+    args = parser.parse_args(argv)
+
+    out_path = os.path.abspath(args.out)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    environment = environment_info()
+
+    # Caches e journal do sistema ficam num diretório temporário
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            results = run_benchmarks(args.sizes, args.formats, args.history,
+                                     args.scans, args.repeat, args.seed)
+        finally:
+            os.chdir(cwd)
+
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment,
+                   'parameters': vars(args),
+                   'results': results}, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados gravados em {out_path}")
+
+    if compare_path:
+        compare_results(results, compare_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""Núcleo sem Streamlit do Material Checker Pro
+
+O `streamlit run` reexecuta sistema.py como um novo __main__ a cada rerun.
+O que roda nos pools de processos (e precisa ser serializável por nome) e
+os caches que devem durar o processo inteiro ficam aqui, num módulo
+importado uma única vez.
+"""
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import xlsxwriter
+except ImportError:  # exportação em streaming indisponível
+    xlsxwriter = None
+
+try:
+    import barcode
+except ImportError:  # geração de etiquetas indisponível
+    barcode = None
+
+
+def category_counts(series):
+    """Contagem por categoria via códigos (só categorias presentes)"""
+    codes = series.cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0],
+                         minlength=len(series.cat.categories))
+    result = pd.Series(counts, index=series.cat.categories, name='count')
+    return result[result > 0].sort_values(ascending=False, kind='stable')
+
+
+# Limite de linhas de uma aba do Excel (inclui o cabeçalho)
+EXCEL_MAX_ROWS = 1048576
+
+
+def _write_sheet_rows(workbook, sheet_name, columns, rows):
+    """Escreve cabeçalho e linhas, abrindo novas abas ao atingir o limite"""
+    header_format = workbook.add_format({'bold': True, 'border': 1})
+    worksheet, row_idx, sheet_number = None, EXCEL_MAX_ROWS, 0
+    for row in itertools.chain([None], rows):
+        if row_idx >= EXCEL_MAX_ROWS:
+            sheet_number += 1
+            name = sheet_name if sheet_number == 1 else \
+                f"{sheet_name}_{sheet_number}"
+            worksheet = workbook.add_worksheet(name)
+            worksheet.write_row(0, 0, columns, header_format)
+            row_idx = 1
+        if row is not None:
+            # Data/hora inválida (NaT) vira célula em branco
+            worksheet.write_row(row_idx, 0, [None if value is pd.NaT else value
+                                             for value in row])
+            row_idx += 1
+    return worksheet
+
+
+def write_report_stream(report_path, df, history_chunks):
+    """Grava o relatório xlsx linha a linha (xlsxwriter, memória constante)
+
+    `history_chunks` é um iterável de DataFrames com as colunas do
+    histórico, consumido sob demanda (o cabeçalho vem do primeiro).
+    """
+    workbook = xlsxwriter.Workbook(report_path, {
+        'constant_memory': True,
+        'nan_inf_to_errors': True,
+        'default_date_format': 'dd/mm/yyyy hh:mm:ss',
+        'tmpdir': os.path.dirname(os.path.abspath(report_path))
+    })
+
+    _write_sheet_rows(workbook, 'Materiais', list(df.columns),
+                      df.itertuples(index=False, name=None))
+    history_chunks = (chunk for chunk in history_chunks if not chunk.empty)
+    first_chunk = next(history_chunks, None)
+    if first_chunk is not None:
+        history_rows = itertools.chain.from_iterable(
+            chunk.itertuples(index=False, name=None)
+            for chunk in itertools.chain([first_chunk], history_chunks))
+        _write_sheet_rows(workbook, 'Histórico_Checagens',
+                          list(first_chunk.columns), history_rows)
+    stats = category_counts(df['avanco'])
+    _write_sheet_rows(workbook, 'Estatísticas', ['Avanco', 'Quantidade'],
+                      stats.items())
+    workbook.close()
+
+
+def write_etapa_report(task):
+    """Grava o relatório de uma etapa (executado no pool de processos)"""
+    report_path, df, history_df = task
+    write_report_stream(report_path, df, [history_df])
+    return report_path
+
+
+# Codificação das barras das etiquetas (Code 128): cada código distinto é
+# codificado uma única vez por processo, em paralelo quando são muitos
+LABEL_BARCODE_TYPE = 'code128'
+LABEL_POOL_MIN_CODES = 2000
+LABEL_POOL_CHUNK_SIZE = 256
+BARCODE_CACHE_MAX_ITEMS = 100000
+
+_barcode_cache = OrderedDict()
+_barcode_cache_lock = threading.Lock()
+
+
+def encode_barcode(code):
+    """Barras de um código como (total de módulos, operadores PDF)
+
+    As barras saem em unidades de módulo (retângulos de altura 1); na
+    etiqueta basta escalar, sem formatar cada retângulo de novo.
+    """
+    try:
+        modules = barcode.get(LABEL_BARCODE_TYPE, code).build()[0]
+    except Exception:
+        # Caracteres fora do Code 128: etiqueta sai só com o texto
+        return None
+    bars, position = [], 0
+    for bit, group in itertools.groupby(modules):
+        width = sum(1 for _ in group)
+        if bit == '1':
+            bars.append(f"{position} 0 {width} 1 re")
+        position += width
+    return len(modules), " ".join(bars) + " f"
+
+
+def encode_barcodes(codes):
+    """Codifica os códigos distintos ainda não cacheados (em paralelo se muitos)"""
+    unique = list(dict.fromkeys(codes))
+    with _barcode_cache_lock:
+        symbols = {code: _barcode_cache[code] for code in unique
+                   if code in _barcode_cache}
+    pending = [code for code in unique if code not in symbols]
+
+    if len(pending) >= LABEL_POOL_MIN_CODES:
+        with ProcessPoolExecutor() as pool:
+            encoded = list(pool.map(encode_barcode, pending,
+                                    chunksize=LABEL_POOL_CHUNK_SIZE))
+    else:
+        encoded = [encode_barcode(code) for code in pending]
+
+    with _barcode_cache_lock:
+        for code, symbol in zip(pending, encoded):
+            symbols[code] = symbol
+            _barcode_cache[code] = symbol
+        while len(_barcode_cache) > BARCODE_CACHE_MAX_ITEMS:
+            _barcode_cache.popitem(last=False)
+    return symbols
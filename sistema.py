@@ -1,18 +1,151 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from datetime import datetime
+from datetime import datetime, timedelta
 import io
 import tempfile
 from reportlab.lib.units import cm, mm
+from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 import logging
+import logging.handlers
+import queue
+import atexit
 import json
 import os
+import sys
+import argparse
+import itertools
+import re
+import zipfile
+import hashlib
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import sqlite3
+import socket
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+import functools
+
+from nucleo import (barcode, xlsxwriter, category_counts, encode_barcodes,
+                    write_etapa_report, write_report_stream)
 
 # Configurar sistema de logs
 
 
+# Log estruturado das checagens: JSON lines gravado em lote por uma thread
+# própria (a leitura nunca espera pelo disco), com rotação por tamanho e tempo
+SCAN_LOG_FILENAME = 'material_checker_scans.jsonl'
+SCAN_LOG_MAX_BYTES = 20 * 1024 * 1024
+SCAN_LOG_BACKUPS = 10
+SCAN_LOG_ROTATE_SECONDS = 24 * 60 * 60
+SCAN_LOG_FLUSH_INTERVAL = 1.0
+SCAN_LOG_MAX_BATCH = 1000
+
+scan_logger = logging.getLogger('material_checker.scans')
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formata um evento de log como uma linha JSON"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'event': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ScanLogWriter(threading.Thread):
+    """Consome a fila de logs e grava em lote, rotacionando o arquivo"""
+
+    def __init__(self, path, max_bytes=SCAN_LOG_MAX_BYTES,
+                 backups=SCAN_LOG_BACKUPS, rotate_seconds=SCAN_LOG_ROTATE_SECONDS):
+        super().__init__(name='scan-log-writer', daemon=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.rotate_seconds = rotate_seconds
+        self.queue = queue.SimpleQueue()
+        self.formatter = JsonLinesFormatter()
+        self._stream = None
+        self._rollover_at = 0.0
+
+    def _open(self):
+        self._stream = open(self.path, 'a', encoding='utf-8')
+        # Como no TimedRotatingFileHandler: um arquivo existente conta a
+        # partir do mtime, então reiniciar o processo não adia a rotação
+        stat = os.fstat(self._stream.fileno())
+        started = stat.st_mtime if stat.st_size else time.time()
+        self._rollover_at = started + self.rotate_seconds
+
+    def _should_rotate(self, pending_bytes):
+        if self._stream.tell() == 0:
+            return False
+        return (self._stream.tell() + pending_bytes > self.max_bytes or
+                time.time() >= self._rollover_at)
+
+    def _rotate(self):
+        self._stream.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def _write(self, records):
+        data = ''.join(self.formatter.format(r) + '\n' for r in records)
+        try:
+            if self._stream is None:
+                self._open()
+            if self._should_rotate(len(data.encode('utf-8'))):
+                self._rotate()
+            self._stream.write(data)
+            self._stream.flush()
+        except OSError as e:
+            # Falha de disco não pode derrubar a thread de log
+            logging.error(f"Erro ao gravar log de leituras: {str(e)}")
+            if self._stream is not None:
+                try:
+                    self._stream.close()
+                except OSError:
+                    pass
+            self._stream = None
+
+    def run(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + SCAN_LOG_FLUSH_INTERVAL
+            while len(batch) < SCAN_LOG_MAX_BATCH:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if None in batch:
+                stop = True
+                batch = [r for r in batch if r is not None]
+            if batch:
+                self._write(batch)
+
+    def stop(self, timeout=5.0):
+        """Grava o que estiver pendente e encerra a thread"""
+        self.queue.put(None)
+        self.join(timeout)
+
+
 def setup_logging():
     """Configura sistema de logs"""
     logging.basicConfig(
@@ -20,71 +153,950 @@ def setup_logging():
         level=logging.INFO,
         format='%(asctime)s - %(levelname)s - %(message)s'
     )
+    start_scan_log_writer()
+
+
+# O logger é do processo, mas o script é reexecutado a cada rerun: a thread
+# e o handler ficam no st.cache_resource para serem criados uma única vez
+@st.cache_resource(show_spinner=False)
+def start_scan_log_writer():
+    """Inicia a thread de gravação do log de leituras (uma por processo)"""
+    writer = ScanLogWriter(SCAN_LOG_FILENAME)
+    writer.start()
+    scan_logger.addHandler(logging.handlers.QueueHandler(writer.queue))
+    scan_logger.setLevel(logging.INFO)
+    scan_logger.propagate = False
+    atexit.register(writer.stop)
+    return writer
+
+
+def log_material_check(material_id, avanco_status, found, user_id="system",
+                       result=None, latency_ms=None):
+    """Registra checagem nos logs (enfileirado, sem bloquear a leitura)"""
+    fields = {
+        'id': material_id,
+        'avanco': avanco_status,
+        'found': found,
+        'result': result,
+        'station': user_id
+    }
+    if latency_ms is not None:
+        fields['latency_ms'] = round(latency_ms, 3)
+    scan_logger.info('material_check', extra={'fields': fields})
+
 
+# Instrumentação de latência dos caminhos críticos (por processo): janela
+# das últimas chamadas para p50/p95/p99 e exportação no formato Prometheus
+PERF_MAX_SAMPLES = 2048
+PERF_SLOW_THRESHOLD_MS = 250
+METRICS_FILENAME = 'material_checker_metrics.prom'
+METRICS_EXPORT_INTERVAL = 30
 
-def log_material_check(material_id, avanco_status, found, user_id="system"):
-    """Registra checagem nos logs"""
-    logging.info(
-        f"Material check: ID={material_id}, Avanco={avanco_status}, Found={found}, User={user_id}")
+
+# O script é reexecutado como um novo módulo a cada rerun: as amostras ficam
+# no st.cache_resource para cobrir o histórico de chamadas do processo
+@st.cache_resource(show_spinner=False)
+def shared_perf_state():
+    """Trava e estatísticas de latência compartilhadas pelo processo"""
+    return threading.Lock(), {}
+
+
+_perf_lock, _perf_stats = shared_perf_state()
+
+
+def record_timing(name, seconds):
+    """Registra a duração de uma chamada"""
+    with _perf_lock:
+        stats = _perf_stats.get(name)
+        if stats is None:
+            stats = _perf_stats[name] = {
+                'recent': deque(maxlen=PERF_MAX_SAMPLES), 'count': 0, 'sum': 0.0}
+        stats['recent'].append(seconds)
+        stats['count'] += 1
+        stats['sum'] += seconds
+
+
+@contextmanager
+def perf_span(name):
+    """Mede o tempo de um bloco de código"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - started)
+
+
+def timed(name=None):
+    """Decorador que mede cada chamada da função"""
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with perf_span(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def perf_snapshot():
+    """Cópia das amostras atuais: nome -> (amostras, total de chamadas, soma)"""
+    with _perf_lock:
+        return {name: (np.fromiter(stats['recent'], dtype=float),
+                       stats['count'], stats['sum'])
+                for name, stats in _perf_stats.items()}
+
+
+def perf_summary():
+    """Tabela de latências (ms) por operação"""
+    rows = []
+    for name, (samples, count, total) in sorted(perf_snapshot().items()):
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+        rows.append({
+            'Operação': name,
+            'Chamadas': count,
+            'p50 (ms)': p50,
+            'p95 (ms)': p95,
+            'p99 (ms)': p99,
+            'Máx (ms)': samples.max() * 1000,
+            'Lenta': '⚠️' if p95 > PERF_SLOW_THRESHOLD_MS else ''
+        })
+    return pd.DataFrame(rows, columns=['Operação', 'Chamadas', 'p50 (ms)',
+                                       'p95 (ms)', 'p99 (ms)', 'Máx (ms)',
+                                       'Lenta'])
+
+
+def format_prometheus_metrics():
+    """Latências no formato texto do Prometheus (summary)"""
+    metric = 'material_checker_duration_seconds'
+    lines = [f"# HELP {metric} Duração das operações instrumentadas",
+             f"# TYPE {metric} summary"]
+    for name, (samples, count, total) in sorted(perf_snapshot().items()):
+        for quantile, value in zip(('0.5', '0.95', '0.99'),
+                                   np.percentile(samples, [50, 95, 99])):
+            lines.append(f'{metric}{{op="{name}",quantile="{quantile}"}} {value:.6f}')
+        lines.append(f'{metric}_sum{{op="{name}"}} {total:.6f}')
+        lines.append(f'{metric}_count{{op="{name}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics_file(path=METRICS_FILENAME):
+    """Grava o arquivo de métricas de forma atômica"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(format_prometheus_metrics())
+    os.replace(tmp_path, path)
+
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_exporter(path=METRICS_FILENAME, interval=METRICS_EXPORT_INTERVAL):
+    """Inicia (uma vez por processo) a gravação periódica das métricas"""
+    def export_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_metrics_file(path)
+            except OSError as e:
+                logging.warning(f"Erro ao gravar métricas: {str(e)}")
+
+    thread = threading.Thread(target=export_loop, name='metrics-exporter',
+                              daemon=True)
+    thread.start()
+    return thread
 
 
 # Sistema de cache para persistência
-def save_to_cache(data, filename="material_checker_cache.json"):
+# O histórico é salvo como snapshot JSON + journal JSONL (append-only):
+# cada checagem grava só o novo registro e o journal é compactado no
+# snapshot periodicamente.
+CACHE_DIR = "cache"
+CACHE_FILENAME = "material_checker_cache.json"
+JOURNAL_FILENAME = "material_checker_journal.jsonl"
+# Na compactação o journal é renomeado para um arquivo pendente com um
+# token; o snapshot registra os tokens incorporados, e a leitura ignora os
+# pendentes já incorporados (queda entre gravar o snapshot e apagá-los)
+JOURNAL_PENDING_SUFFIX = ".pending"
+# Metadados do snapshot (quantidade e data) para checar o cache sem lê-lo
+CACHE_META_FILENAME = "material_checker_cache.meta.json"
+JOURNAL_COMPACT_EVERY = 500
+
+
+# Sessões em reruns diferentes executam cópias distintas do script: a trava
+# do journal precisa ser a mesma para o processo inteiro
+@st.cache_resource(show_spinner=False)
+def shared_cache_state():
+    """Trava do cache, contagem do journal e memo dos metadados (processo)"""
+    return threading.Lock(), {'entries': None}, {'key': None, 'value': None}
+
+
+_cache_lock, _journal_state, _cache_meta_memo = shared_cache_state()
+
+
+def save_to_cache(data, filename=CACHE_FILENAME):
     """Salva dados no cache local"""
     try:
-        cache_dir = "cache"
+        cache_dir = CACHE_DIR
         if not os.path.exists(cache_dir):
             os.makedirs(cache_dir)
 
         cache_path = os.path.join(cache_dir, filename)
-        with open(cache_path, 'w', encoding='utf-8') as f:
+        # Escrita atômica para não corromper o snapshot durante a compactação
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, cache_path)
+        if filename == CACHE_FILENAME:
+            write_cache_meta(data, cache_path)
         return True
     except Exception as e:
         logging.error(f"Erro ao salvar cache: {str(e)}")
         return False
 
 
-def load_from_cache(filename="material_checker_cache.json"):
-    """Carrega dados do cache local"""
-    try:
-        cache_dir = "cache"
-        cache_path = os.path.join(cache_dir, filename)
+def write_cache_meta(data, cache_path):
+    """Grava o arquivo de metadados ligado à versão atual do snapshot"""
+    stat = os.stat(cache_path)
+    meta = {
+        'snapshot_mtime_ns': stat.st_mtime_ns,
+        'snapshot_size': stat.st_size,
+        'total_items': len(data.get('history', [])),
+        'timestamp': data.get('timestamp'),
+        'folded_journals': data.get('folded_journals', [])
+    }
+    meta_path = os.path.join(CACHE_DIR, CACHE_META_FILENAME)
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+    return meta
 
-        if os.path.exists(cache_path):
-            with open(cache_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+
+def read_snapshot_meta(cache_path, stat):
+    """Quantidade e data do snapshot pelos metadados (lê o snapshot só se faltarem)"""
+    meta_path = os.path.join(CACHE_DIR, CACHE_META_FILENAME)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('snapshot_mtime_ns') == stat.st_mtime_ns and \
+                meta.get('snapshot_size') == stat.st_size:
+            return meta
+    except (OSError, ValueError):
+        pass
+
+    # Snapshot antigo ou metadados desatualizados: recalcula uma única vez
+    with open(cache_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return write_cache_meta(data, cache_path)
+
+
+def count_journal_records(journal_path):
+    """Conta as linhas do journal sem decodificar o JSON"""
+    with open(journal_path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+
+def pending_journals():
+    """Journals renomeados para compactação: [(token, caminho)], mais antigos antes"""
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    prefix = os.path.splitext(JOURNAL_FILENAME)[0] + "."
+    pending = [os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR)
+               if name.startswith(prefix) and name.endswith(JOURNAL_PENDING_SUFFIX)]
+    pending.sort(key=os.path.getmtime)
+    return [(os.path.basename(path)[len(prefix):-len(JOURNAL_PENDING_SUFFIX)], path)
+            for path in pending]
+
+
+def cache_metadata():
+    """Quantidade de registros e data do cache, memorizados por mtime/tamanho"""
+    cache_path = os.path.join(CACHE_DIR, CACHE_FILENAME)
+    journal_path = os.path.join(CACHE_DIR, JOURNAL_FILENAME)
+    try:
+        pending = pending_journals()
+        paths = [cache_path, journal_path] + [path for _, path in pending]
+        stats = [os.stat(path) if os.path.exists(path) else None
+                 for path in paths]
+        key = tuple((path, file_stat.st_mtime_ns, file_stat.st_size)
+                    if file_stat else None for path, file_stat in zip(paths, stats))
+        if key == _cache_meta_memo['key']:
+            return _cache_meta_memo['value']
+
+        snapshot_stat, journal_stat = stats[:2]
+        total_items, timestamp, folded = 0, None, set()
+        if snapshot_stat is not None:
+            meta = read_snapshot_meta(cache_path, snapshot_stat)
+            total_items, timestamp = meta['total_items'], meta['timestamp']
+            folded = set(meta.get('folded_journals') or [])
+        for token, path in pending:
+            if token not in folded:
+                total_items += count_journal_records(path)
+        if journal_stat is not None:
+            total_items += count_journal_records(journal_path)
+            timestamp = datetime.fromtimestamp(journal_stat.st_mtime).isoformat()
+
+        value = {'total_items': total_items, 'timestamp': timestamp} \
+            if any(stats) else None
+        _cache_meta_memo.update(key=key, value=value)
+        return value
+    except Exception as e:
+        logging.error(f"Erro ao ler metadados do cache: {str(e)}")
         return None
+
+
+def load_journal(filename=JOURNAL_FILENAME):
+    """Lê os registros do journal de checagens"""
+    journal_path = filename if os.path.isabs(filename) or \
+        os.path.dirname(filename) else os.path.join(CACHE_DIR, filename)
+    records = []
+    if not os.path.exists(journal_path):
+        return records
+
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Linha incompleta (ex.: queda durante a escrita)
+                logging.warning("Registro inválido ignorado no journal")
+    return records
+
+
+def _read_cache(filename=CACHE_FILENAME):
+    """Snapshot + journals pendentes não incorporados + journal (sem trava)"""
+    cache_path = os.path.join(CACHE_DIR, filename)
+    journal_path = os.path.join(CACHE_DIR, JOURNAL_FILENAME)
+
+    data = None
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+    folded = (data or {}).get('folded_journals', [])
+    journal = []
+    for token, path in pending_journals():
+        if token not in folded:
+            journal.extend(load_journal(path))
+    journal.extend(load_journal())
+
+    if journal:
+        history = (data or {}).get('history', []) + journal
+        timestamp = datetime.fromtimestamp(os.path.getmtime(journal_path)) \
+            if os.path.exists(journal_path) else datetime.now()
+        data = {
+            'history': history,
+            'timestamp': timestamp.isoformat(),
+            'total_items': len(history),
+            'folded_journals': folded
+        }
+    return data
+
+
+def load_from_cache(filename=CACHE_FILENAME):
+    """Carrega dados do cache local (snapshot + journal)"""
+    try:
+        # Mesma trava da compactação: nunca lê um estado intermediário
+        with _cache_lock:
+            return _read_cache(filename)
     except Exception as e:
         logging.error(f"Erro ao carregar cache: {str(e)}")
         return None
 
 
-def auto_save_history():
-    """Salva automaticamente o histórico no cache"""
-    if st.session_state.check_history:
-        cache_data = {
-            'history': st.session_state.check_history,
-            'timestamp': datetime.now().isoformat(),
-            'total_items': len(st.session_state.check_history)
-        }
+def append_to_journal(records, filename=JOURNAL_FILENAME):
+    """Acrescenta registros ao journal sem reescrever o histórico"""
+    try:
+        if not os.path.exists(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+
+        journal_path = os.path.join(CACHE_DIR, filename)
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n"
+                        for record in records)
+        with open(journal_path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+        return True
+    except Exception as e:
+        logging.error(f"Erro ao gravar journal: {str(e)}")
+        return False
+
+
+def compact_cache():
+    """Incorpora o journal ao snapshot e trunca o journal
+
+    Chamada com `_cache_lock` já adquirida. O journal é renomeado antes de
+    ser incorporado; o snapshot guarda os tokens dos arquivos incorporados,
+    então uma queda antes de apagá-los não duplica registros na leitura.
+    """
+    journal_path = os.path.join(CACHE_DIR, JOURNAL_FILENAME)
+    try:
+        if os.path.exists(journal_path):
+            pending_path = os.path.join(
+                CACHE_DIR, f"{os.path.splitext(JOURNAL_FILENAME)[0]}."
+                f"{uuid.uuid4().hex}{JOURNAL_PENDING_SUFFIX}")
+            os.replace(journal_path, pending_path)
+
+        pending = pending_journals()
+        data = _read_cache()
+    except Exception as e:
+        logging.error(f"Erro ao compactar cache: {str(e)}")
+        return False
+    if data is None:
+        return False
+
+    data['timestamp'] = datetime.now().isoformat()
+    data['folded_journals'] = [token for token, _ in pending]
+    if not save_to_cache(data):
+        return False
+
+    for _, path in pending:
+        os.remove(path)
+    return True
+
+
+def clear_cache():
+    """Remove snapshot e journal do cache"""
+    with _cache_lock:
+        paths = [os.path.join(CACHE_DIR, filename) for filename in
+                 (CACHE_FILENAME, JOURNAL_FILENAME, CACHE_META_FILENAME)]
+        for path in paths + [path for _, path in pending_journals()]:
+            if os.path.exists(path):
+                os.remove(path)
+        _journal_state['entries'] = 0
 
-        if save_to_cache(cache_data):
-            # Status visual discreto do auto-save
-            st.session_state.last_autosave = datetime.now().strftime("%H:%M:%S")
+
+def append_history_journal(records):
+    """Acrescenta registros ao journal e compacta quando necessário"""
+    with _cache_lock:
+        if _journal_state['entries'] is None:
+            _journal_state['entries'] = len(load_journal())
+
+        if not append_to_journal(records):
+            return False
+        _journal_state['entries'] += len(records)
+
+        # Compactação periódica do journal no snapshot
+        if _journal_state['entries'] >= JOURNAL_COMPACT_EVERY:
+            if compact_cache():
+                _journal_state['entries'] = 0
+    return True
+
+
+# Backends de histórico: journal local (padrão) ou SQLite em modo WAL,
+# que aceita várias estações gravando no mesmo banco
+HISTORY_BACKEND = os.environ.get('MATERIAL_CHECKER_BACKEND', 'journal')
+SQLITE_PATH = os.environ.get('MATERIAL_CHECKER_DB',
+                             os.path.join(CACHE_DIR, "material_checker.db"))
+DEFAULT_STATION_ID = os.environ.get('MATERIAL_CHECKER_STATION',
+                                    socket.gethostname())
+
+# Parâmetro da URL que guarda a estação escolhida (sobrevive a recarregar)
+STATION_QUERY_PARAM = 'estacao'
+
+
+def remember_station():
+    """Grava a estação editada na URL da página"""
+    station = st.session_state.station_id.strip() or DEFAULT_STATION_ID
+    st.session_state.station_id = station
+    st.query_params[STATION_QUERY_PARAM] = station
+
+
+class JournalHistoryBackend:
+    """Histórico em snapshot JSON + journal JSONL (uma única estação)"""
+
+    name = 'journal'
+
+    def append(self, records, station_id=None, session_id=None):
+        return append_history_journal(records)
+
+    def load(self, station_id=None):
+        return load_from_cache()
+
+    def metadata(self, station_id=None):
+        """Quantidade e data do histórico salvo, sem carregá-lo"""
+        return cache_metadata()
+
+    def clear(self, station_id=None):
+        clear_cache()
+        return True
+
+    def progress(self, avanco):
+        """Progresso agregado entre estações (não disponível no journal)"""
+        return None
+
+    def query(self, id_codigo=None, since=None, until=None, limit=1000):
+        """Consulta de checagens (não disponível no journal)"""
+        return None
+
+
+class SQLiteHistoryBackend:
+    """Histórico em SQLite (WAL) compartilhado por várias estações"""
+
+    name = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS checks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_codigo TEXT NOT NULL,
+            etapa_programa TEXT,
+            trait TEXT,
+            avanco TEXT,
+            check_time TEXT,
+            encontrado TEXT NOT NULL,
+            checked_at REAL NOT NULL,
+            station_id TEXT,
+            session_id TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_checks_id_codigo ON checks(id_codigo);
+        CREATE INDEX IF NOT EXISTS idx_checks_checked_at ON checks(checked_at);
+        CREATE INDEX IF NOT EXISTS idx_checks_station ON checks(station_id);
+        CREATE INDEX IF NOT EXISTS idx_checks_progress
+            ON checks(avanco, encontrado, id_codigo);
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connection(self):
+        """Conexão própria de cada thread (sessões do Streamlit)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def append(self, records, station_id=None, session_id=None):
+        try:
+            checked_at = time.time()
+            with self._connection() as conn:
+                conn.executemany(
+                    "INSERT INTO checks (id_codigo, etapa_programa, trait, avanco, "
+                    "check_time, encontrado, checked_at, station_id, session_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(r['id_codigo'], r['etapa_programa'], r['trait'],
+                      r['avanco'], r['check_time'], r['encontrado'],
+                      checked_at, station_id, session_id) for r in records])
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao gravar histórico no SQLite: {str(e)}")
+            return False
+
+    def load(self, station_id=None):
+        try:
+            conn = self._connection()
+            where, params = ("WHERE station_id = ?", (station_id,)) \
+                if station_id else ("", ())
+            rows = conn.execute(
+                "SELECT id_codigo, etapa_programa, trait, avanco, check_time, "
+                f"encontrado, checked_at FROM checks {where} ORDER BY id",
+                params).fetchall()
+            if not rows:
+                return None
+            return {
+                'history': [dict(zip(HISTORY_COLUMNS, row[:6])) for row in rows],
+                'timestamp': datetime.fromtimestamp(rows[-1][6]).isoformat(),
+                'total_items': len(rows)
+            }
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao carregar histórico do SQLite: {str(e)}")
+            return None
+
+    def metadata(self, station_id=None):
+        """Quantidade e data do histórico da estação (pelo índice)"""
+        try:
+            where, params = ("WHERE station_id = ?", (station_id,)) \
+                if station_id else ("", ())
+            count, last = self._connection().execute(
+                f"SELECT COUNT(*), MAX(checked_at) FROM checks {where}",
+                params).fetchone()
+            if not count:
+                return None
+            return {'total_items': count,
+                    'timestamp': datetime.fromtimestamp(last).isoformat()}
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao consultar histórico do SQLite: {str(e)}")
+            return None
+
+    def clear(self, station_id=None):
+        """Apaga o histórico da estação (ou de todas, sem estação)"""
+        try:
+            with self._connection() as conn:
+                if station_id:
+                    conn.execute("DELETE FROM checks WHERE station_id = ?",
+                                 (station_id,))
+                else:
+                    conn.execute("DELETE FROM checks")
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao limpar histórico do SQLite: {str(e)}")
+            return False
+
+    def progress(self, avanco):
+        """Materiais distintos verificados com o avanço, em todas as estações"""
+        try:
+            row = self._connection().execute(
+                "SELECT COUNT(DISTINCT id_codigo) FROM checks "
+                "WHERE avanco = ? AND encontrado = 'Sim'", (avanco,)).fetchone()
+            return row[0]
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao consultar progresso no SQLite: {str(e)}")
+            return None
+
+    def query(self, id_codigo=None, since=None, until=None, limit=1000):
+        """Checagens filtradas por código e/ou período (usa os índices)"""
+        clauses, params = [], []
+        if id_codigo:
+            clauses.append("id_codigo = ?")
+            params.append(id_codigo)
+        if since is not None:
+            clauses.append("checked_at >= ?")
+            params.append(since.timestamp())
+        if until is not None:
+            clauses.append("checked_at < ?")
+            params.append(until.timestamp())
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return pd.read_sql_query(
+            "SELECT id_codigo, etapa_programa, trait, avanco, check_time, "
+            f"encontrado, station_id FROM checks {where} "
+            "ORDER BY id DESC LIMIT ?",
+            self._connection(), params=params + [limit])
+
+
+# Uma instância por processo (conexões e travas), mantida entre os reruns
+@st.cache_resource(show_spinner=False)
+def shared_history_backend(name):
+    """Instância compartilhada do backend de histórico"""
+    return SQLiteHistoryBackend() if name == 'sqlite' else JournalHistoryBackend()
+
+
+def get_history_backend(name=None):
+    """Backend de histórico configurado (instância compartilhada)"""
+    return shared_history_backend(name or HISTORY_BACKEND)
+
+
+@timed()
+def auto_save_history(records):
+    """Salva automaticamente os novos registros do histórico no cache"""
+    if not records:
+        return
+
+    saved = get_history_backend().append(
+        records,
+        station_id=st.session_state.get('station_id'),
+        session_id=st.session_state.get('session_id'))
+
+    if saved:
+        # Status visual discreto do auto-save
+        st.session_state.last_autosave = datetime.now().strftime("%H:%M:%S")
+
+
+# Histórico de checagens em formato colunar: strings internadas como
+# códigos inteiros e horários como int64 (segundos desde a época)
+HISTORY_COLUMNS = ['id_codigo', 'etapa_programa', 'trait', 'avanco',
+                   'check_time', 'encontrado']
+CHECK_TIME_FORMAT = "%d/%m/%Y %H:%M:%S"
+_EPOCH = datetime(1970, 1, 1)
+_NAT = np.iinfo(np.int64).min
+
+
+class HistoryStore:
+    """Histórico de checagens em arrays tipados crescentes"""
+
+    # Colunas de baixa cardinalidade guardadas como códigos; os IDs (quase
+    # todos distintos) ficam num array de objetos, sem dicionário de
+    # categorias que cresceria com o histórico
+    STRING_COLUMNS = ('etapa_programa', 'trait', 'avanco', 'encontrado')
+
+    def __init__(self, records=None, capacity=1024):
+        self._size = 0
+        self._ids = np.empty(capacity, dtype=object)
+        self._codes = {col: np.empty(capacity, dtype=np.int32)
+                       for col in self.STRING_COLUMNS}
+        self._times = np.empty(capacity, dtype=np.int64)
+        self._lookup = {col: {} for col in self.STRING_COLUMNS}
+        self._categories = {col: [] for col in self.STRING_COLUMNS}
+        if records:
+            self.extend(records)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self.record(i)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError("índice fora do histórico")
+        return self.record(i)
+
+    def _intern(self, col, value):
+        """Devolve o código da string na coluna, criando se necessário"""
+        value = str(value)
+        lookup = self._lookup[col]
+        code = lookup.get(value)
+        if code is None:
+            code = len(self._categories[col])
+            lookup[value] = code
+            self._categories[col].append(value)
+        return code
+
+    def _reserve(self, extra):
+        """Garante capacidade para mais `extra` registros (dobra o tamanho)"""
+        needed = self._size + extra
+        capacity = len(self._times)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        grown = np.empty(capacity, dtype=object)
+        grown[:self._size] = self._ids[:self._size]
+        self._ids = grown
+        for col in self.STRING_COLUMNS:
+            grown = np.empty(capacity, dtype=np.int32)
+            grown[:self._size] = self._codes[col][:self._size]
+            self._codes[col] = grown
+        grown = np.empty(capacity, dtype=np.int64)
+        grown[:self._size] = self._times[:self._size]
+        self._times = grown
+
+    def append(self, record):
+        self.extend([record])
+
+    def extend(self, records):
+        records = list(records)
+        if not records:
+            return
+        self._reserve(len(records))
+        start, stop = self._size, self._size + len(records)
+
+        self._ids[start:stop] = [str(record.get('id_codigo', 'N/A'))
+                                 for record in records]
+        for col in self.STRING_COLUMNS:
+            self._codes[col][start:stop] = [
+                self._intern(col, record.get(col, 'N/A')) for record in records]
+
+        times = pd.to_datetime([record.get('check_time') for record in records],
+                               format=CHECK_TIME_FORMAT, errors='coerce')
+        self._times[start:stop] = np.where(
+            times.isna(), _NAT,
+            (times - pd.Timestamp(_EPOCH)) // pd.Timedelta(seconds=1))
+        self._size = stop
+
+    def record(self, i):
+        """Reconstrói o registro i como dicionário"""
+        record = {col: self._categories[col][self._codes[col][i]]
+                  for col in self.STRING_COLUMNS}
+        record['id_codigo'] = self._ids[i]
+        seconds = int(self._times[i])
+        record['check_time'] = '' if seconds == _NAT else (
+            _EPOCH + timedelta(seconds=seconds)).strftime(CHECK_TIME_FORMAT)
+        return {col: record[col] for col in HISTORY_COLUMNS}
+
+    def to_records(self):
+        return list(self)
+
+    def to_frame(self, positions=None):
+        """DataFrame do histórico sobre os arrays (categorias + datetime64)"""
+        if positions is None:
+            positions = slice(0, self._size)
+        data = {}
+        for col in HISTORY_COLUMNS:
+            if col == 'id_codigo':
+                data[col] = self._ids[:self._size][positions]
+            elif col == 'check_time':
+                data[col] = self._times[:self._size][positions].view(
+                    'datetime64[s]')
+            else:
+                data[col] = pd.Categorical.from_codes(
+                    self._codes[col][:self._size][positions],
+                    categories=self._categories[col])
+        return pd.DataFrame(data, copy=False)
+
+
+# Estilos do histórico detalhado
+HISTORY_PAGE_SIZES = [50, 100, 250, 500, 1000]
+HISTORY_DEFAULT_PAGE_SIZE = 100
+FOUND_STATUS_STYLES = {
+    'CE3': 'background-color: #8b5cf6; color: white; font-weight: 700;',  # Roxo
+    'E3': 'background-color: #10b981; color: white; font-weight: 700;',   # Verde
+    'CONV': 'background-color: #f59e0b; color: white; font-weight: 700;'  # Laranja
+}
+FOUND_DEFAULT_STYLE = 'background-color: #10b981; color: white; font-weight: 700;'
+WRONG_AVANCO_STYLE = 'background-color: #fef3c7; color: #92400e; font-weight: 600;'
+NOT_FOUND_STYLE = 'background-color: #fef2f2; color: #dc2626; font-weight: 600;'
+DUPLICATE_STYLE = 'background-color: #e0e7ff; color: #3730a3; font-weight: 600;'
+
+
+def history_page_positions(total, page, page_size):
+    """Posições de uma página do histórico, da mais recente para a mais antiga"""
+    stop = max(total - page * page_size, 0)
+    start = max(stop - page_size, 0)
+    return np.arange(stop - 1, start - 1, -1)
+
+
+def history_status_styles(history_df):
+    """Calcula os estilos da coluna 'encontrado' de forma vetorizada"""
+    styles = pd.DataFrame('', index=history_df.index,
+                          columns=history_df.columns)
+    status = history_df['encontrado'].astype(str)
+    # Sim: cor do trait; avanço incorreto: amarelo; não encontrado: vermelho
+    found_styles = history_df['trait'].astype(str).map(
+        FOUND_STATUS_STYLES).fillna(FOUND_DEFAULT_STYLE)
+    styles['encontrado'] = np.select(
+        [status == 'Sim', status.str.contains('incorreto', regex=False),
+         status == 'Duplicado'],
+        [found_styles, WRONG_AVANCO_STYLE, DUPLICATE_STYLE],
+        NOT_FOUND_STYLE)
+    return styles
+
+
+# Contadores de progresso mantidos incrementalmente a cada checagem
+SCAN_STATUS_KEYS = {
+    'Sim': 'found',
+    'Não - Avanço incorreto': 'wrong_avanco',
+    'Não': 'not_found',
+    'Duplicado': 'duplicate'
+}
+
+# Política para leituras repetidas de materiais já confirmados
+DUPLICATE_POLICIES = {
+    'registrar': "📝 Registrar como duplicado",
+    'ignorar': "🚫 Ignorar",
+    'contar uma vez': "1️⃣ Registrar, mas contar uma vez"
+}
+DEFAULT_DUPLICATE_POLICY = 'registrar'
+
+
+def new_scan_counters():
+    """Cria a estrutura de contadores de checagem"""
+    return {
+        'status': Counter(),     # status
+        'by_avanco': Counter(),  # (avanco, status)
+        'by_etapa': Counter(),   # (avanco, etapa_programa, status)
+        'by_trait': Counter(),   # (avanco, trait, status)
+        'confirmed': {}          # avanco -> IDs já confirmados
+    }
+
+
+def is_duplicate_scan(counters, record):
+    """Verifica (O(1)) se o material já foi confirmado com este avanço"""
+    return record.get('encontrado') == 'Sim' and record.get('id_codigo') in \
+        counters['confirmed'].get(record.get('avanco'), ())
+
+
+def apply_duplicate_policy(records, counters, policy):
+    """Trata leituras repetidas de materiais já confirmados
+
+    'registrar' grava como 'Duplicado', 'ignorar' descarta a leitura e
+    'contar uma vez' grava normalmente, mas o progresso conta só a primeira.
+    """
+    accepted = []
+    batch_confirmed = set()
+    for record in records:
+        key = (record.get('avanco'), record.get('id_codigo'))
+        duplicate = is_duplicate_scan(counters, record) or (
+            record.get('encontrado') == 'Sim' and key in batch_confirmed)
+        if record.get('encontrado') == 'Sim':
+            batch_confirmed.add(key)
+
+        if not duplicate or policy == 'contar uma vez':
+            accepted.append(record)
+        elif policy != 'ignorar':
+            accepted.append(dict(record, encontrado='Duplicado'))
+    return accepted
+
+
+def update_scan_counters(counters, record):
+    """Atualiza os contadores com um registro do histórico (O(1))"""
+    status = SCAN_STATUS_KEYS.get(record.get('encontrado'), 'not_found')
+    avanco = record.get('avanco', 'N/A')
+    if status == 'found':
+        confirmed = counters['confirmed'].setdefault(avanco, set())
+        if record.get('id_codigo') in confirmed:
+            # Repetição ('contar uma vez'): não conta de novo como encontrado
+            status = 'duplicate'
+        confirmed.add(record.get('id_codigo'))
+    counters['status'][status] += 1
+    counters['by_avanco'][(avanco, status)] += 1
+    counters['by_etapa'][(avanco, record.get('etapa_programa'), status)] += 1
+    counters['by_trait'][(avanco, record.get('trait'), status)] += 1
+
+
+def rebuild_scan_counters(history):
+    """Recalcula os contadores a partir de um histórico completo"""
+    counters = new_scan_counters()
+    for record in history:
+        update_scan_counters(counters, record)
+    return counters
+
+
+def compute_catalog_totals(df):
+    """Pré-calcula os totais de materiais por avanço, etapa e trait"""
+    return {
+        'by_avanco': Counter(df.groupby('avanco', sort=False,
+                                        observed=True).size().to_dict()),
+        'by_etapa': Counter(df.groupby(['avanco', 'etapa_programa'],
+                                       sort=False, observed=True).size().to_dict()),
+        'by_trait': Counter(df.groupby(['avanco', 'trait'],
+                                       sort=False, observed=True).size().to_dict())
+    }
+
+
+def etapa_progress_matrix(totals, counters, avanco):
+    """Monta a matriz de progresso por etapa para um avanço"""
+    rows = []
+    for (row_avanco, etapa), total in totals['by_etapa'].items():
+        if row_avanco != avanco:
+            continue
+        found = counters['by_etapa'][(avanco, etapa, 'found')]
+        rows.append({
+            'Etapa': etapa,
+            'Total': total,
+            'Verificados': found,
+            'Faltantes': total - found,
+            'Progresso': 100.0 * found / total if total else 0.0
+        })
+    return pd.DataFrame(rows, columns=['Etapa', 'Total', 'Verificados',
+                                       'Faltantes', 'Progresso'])
+
+
+def record_checks(records):
+    """Adiciona registros ao histórico da sessão e ao cache"""
+    st.session_state.check_history.extend(records)
+    for record in records:
+        update_scan_counters(st.session_state.scan_counters, record)
+    # Versão do histórico invalida relatórios já gerados
+    st.session_state.history_version = st.session_state.get(
+        'history_version', 0) + 1
+    auto_save_history(records)
 
 
 def restore_from_cache():
-    """Restaura histórico do cache se disponível"""
-    cached_data = load_from_cache()
+    """Metadados do cache quando ele tem mais registros que a sessão
 
-    if cached_data and 'history' in cached_data:
-        # Verificar se há dados no cache mais recentes que a sessão atual
-        cache_count = len(cached_data['history'])
-        session_count = len(st.session_state.get('check_history', []))
+    Só compara a quantidade de registros; o histórico completo é lido
+    apenas quando o usuário pede para restaurar.
+    """
+    cached_meta = get_history_backend().metadata(
+        st.session_state.get('station_id'))
 
-        if cache_count > session_count:
-            return cached_data
+    if cached_meta:
+        # Verificar se há dados no cache mais recentes que a sessão atual
+        session_count = len(st.session_state.get('check_history') or [])
+        if cached_meta['total_items'] > session_count:
+            return cached_meta
 
     return None
 
@@ -233,6 +1245,23 @@ def visual_feedback(feedback_type, material_data=None):
         </div>
         """, unsafe_allow_html=True)
 
+    elif feedback_type == "duplicate":
+        st.markdown("""
+        <div style="
+            background: #f59e0b;
+            color: white;
+            padding: 1rem 1.5rem;
+            border-radius: 10px;
+            margin: 1rem 0;
+            font-weight: 700;
+            font-size: 1.1rem;
+            text-align: center;
+            box-shadow: 0 4px 15px rgba(245, 158, 11, 0.4);
+        ">
+            🔁 <strong>Material Já Registrado</strong> - Leitura repetida nesta sessão
+        </div>
+        """, unsafe_allow_html=True)
+
 # Função para validar dados do Excel
 
 
@@ -253,47 +1282,463 @@ def validate_excel_data(df):
 # Função para exportar relatórios
 
 
+# Acima deste total de linhas o relatório é gerado em modo streaming
+EXPORT_STREAMING_MIN_ROWS = 50000
+
+
+def export_report_streaming(df, check_history):
+    """Exporta o relatório com xlsxwriter em modo de memória constante"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report_path = os.path.join(tmp_dir, "relatorio.xlsx")
+        history_chunks = [check_history.to_frame()] if check_history else []
+        write_report_stream(report_path, df, history_chunks)
+
+        with open(report_path, 'rb') as f:
+            return f.read()
+
+
+# Relatório dividido por etapa: um xlsx por etapa_programa, gravados em
+# paralelo e reunidos num zip
+SPLIT_REPORT_POOL_MIN_PARTS = 4
+SPLIT_REPORT_NO_ETAPA = "Sem etapa"
+
+
+def etapa_file_name(etapa, used):
+    """Nome de arquivo seguro e único para uma etapa"""
+    base = re.sub(r'[^\w\-]+', '_', str(etapa)).strip('_') or 'etapa'
+    name, suffix = base, 2
+    while name.lower() in used:
+        name, suffix = f"{base}_{suffix}", suffix + 1
+    used.add(name.lower())
+    return f"relatorio_{name}.xlsx"
+
+
+def partition_by_etapa(df, history_df):
+    """Divide catálogo e histórico por etapa (um groupby em cada)"""
+    catalog_parts = df.groupby('etapa_programa', sort=True,
+                               observed=True).indices
+    history_parts = history_df.groupby('etapa_programa', sort=False,
+                                       observed=True).indices \
+        if not history_df.empty else {}
+
+    parts = []
+    for etapa, positions in catalog_parts.items():
+        history_positions = history_parts.get(etapa, [])
+        parts.append((etapa, df.iloc[positions],
+                      history_df.iloc[history_positions]))
+
+    # Leituras sem etapa no catálogo (ex.: materiais não encontrados)
+    orphan = [positions for etapa, positions in history_parts.items()
+              if etapa not in catalog_parts]
+    if orphan:
+        parts.append((SPLIT_REPORT_NO_ETAPA, df.iloc[[]],
+                      history_df.iloc[np.concatenate(orphan)]))
+    return parts
+
+
+@timed()
+def export_split_report(df, check_history):
+    """Gera um xlsx por etapa e devolve o zip (o arquivo temporário é removido)"""
+    if xlsxwriter is None:
+        raise RuntimeError("Instale xlsxwriter para exportar por etapa")
+
+    history_df = check_history.to_frame() if check_history else \
+        pd.DataFrame(columns=HISTORY_COLUMNS)
+    parts = partition_by_etapa(df, history_df)
+
+    fd, zip_path = tempfile.mkstemp(prefix="relatorio_etapas_", suffix=".zip")
+    os.close(fd)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            used = set()
+            tasks = [(os.path.join(tmp_dir, etapa_file_name(etapa, used)),
+                      part_df, part_history)
+                     for etapa, part_df, part_history in parts]
+
+            workers = os.cpu_count() or 1
+            if workers > 1 and len(tasks) >= SPLIT_REPORT_POOL_MIN_PARTS:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    report_paths = pool.map(
+                        write_etapa_report, tasks,
+                        chunksize=max(1, len(tasks) // (workers * 4)))
+                    # Cada xlsx entra no zip assim que fica pronto
+                    _write_zip(zip_path, report_paths)
+            else:
+                _write_zip(zip_path, map(write_etapa_report, tasks))
+        with open(zip_path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(zip_path)
+
+
+def _write_zip(zip_path, report_paths):
+    """Reúne os relatórios no zip (xlsx já é compactado: sem recompressão)"""
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for report_path in report_paths:
+            archive.write(report_path, os.path.basename(report_path))
+            os.remove(report_path)
+
+
+@timed()
 def export_report(df, check_history):
     """Exporta relatório completo da checagem"""
+    if xlsxwriter is not None and \
+            len(df) + len(check_history) >= EXPORT_STREAMING_MIN_ROWS:
+        return export_report_streaming(df, check_history)
+
     buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+    with pd.ExcelWriter(buffer, engine='openpyxl',
+                        datetime_format='DD/MM/YYYY HH:MM:SS') as writer:
         df.to_excel(writer, sheet_name='Materiais', index=False)
         if check_history:
-            history_df = pd.DataFrame(check_history)
+            history_df = check_history.to_frame()
             history_df.to_excel(
                 writer, sheet_name='Histórico_Checagens', index=False)
-        stats = df['avanco'].value_counts().reset_index()
+        stats = category_counts(df['avanco']).reset_index()
         stats.columns = ['Avanco', 'Quantidade']
         stats.to_excel(writer, sheet_name='Estatísticas', index=False)
     return buffer.getvalue()
 
 
-def filter_materials(df, avanco_filter=None, id_search=None):
-    """Filtra os materiais baseado nos critérios selecionados"""
-    filtered_df = df.copy()
+# Etiquetas com código de barras (Code 128) em folhas A4. A codificação
+# das barras (nucleo.encode_barcodes) roda num pool de processos e cada
+# código distinto é codificado uma única vez; as barras são desenhadas como
+# vetores direto no PDF.
+LABEL_COLUMNS = 3
+LABEL_ROWS = 8
+LABEL_MARGIN = 1 * cm
+LABEL_PADDING = 2 * mm
+LABEL_BAR_HEIGHT = 1.4 * cm
+LABEL_MAX_MODULE_WIDTH = 0.4 * mm
+
+
+def filter_label_rows(df, etapas=None, avanco=None):
+    """Materiais das etapas/avanço escolhidos para impressão"""
+    mask = np.ones(len(df), dtype=bool)
+    if etapas:
+        mask &= df['etapa_programa'].isin(etapas).to_numpy(dtype=bool)
+    if avanco:
+        mask &= (df['avanco'] == avanco).to_numpy(dtype=bool)
+    return df[mask]
+
+
+def draw_label(pdf, x, y, width, height, row, symbol):
+    """Desenha uma etiqueta: etapa/trait, barras e o ID"""
+    pdf.setFont("Helvetica", 7)
+    header = f"{row['etapa_programa']}  {row['trait']}".strip()
+    pdf.drawCentredString(x + width / 2, y + height - LABEL_PADDING - 7, header)
+
+    bar_y = y + LABEL_PADDING + 10
+    if symbol is not None:
+        total_modules, bars = symbol
+        module = min((width - 2 * LABEL_PADDING) / total_modules,
+                     LABEL_MAX_MODULE_WIDTH)
+        start = x + (width - total_modules * module) / 2
+        pdf.saveState()
+        pdf.transform(module, 0, 0, LABEL_BAR_HEIGHT, start, bar_y)
+        pdf.addLiteral(bars)
+        pdf.restoreState()
+
+    pdf.setFont("Helvetica-Bold", 9)
+    pdf.drawCentredString(x + width / 2, y + LABEL_PADDING, str(row['id_codigo']))
+
+
+@timed()
+def write_label_pdf(path, df):
+    """Gera o PDF de etiquetas página a página direto no arquivo"""
+    if barcode is None:
+        raise RuntimeError("Instale python-barcode para gerar etiquetas")
+
+    codes = df['id_codigo'].astype(str).tolist()
+    symbols = encode_barcodes(codes)
+
+    page_width, page_height = A4
+    label_width = (page_width - 2 * LABEL_MARGIN) / LABEL_COLUMNS
+    label_height = (page_height - 2 * LABEL_MARGIN) / LABEL_ROWS
+    per_page = LABEL_COLUMNS * LABEL_ROWS
+
+    pdf = canvas.Canvas(path, pagesize=A4, pageCompression=1)
+    pdf.setTitle("Etiquetas de materiais")
+    columns = ['id_codigo', 'etapa_programa', 'trait']
+    for i, row in enumerate(df[columns].itertuples(index=False)):
+        slot = i % per_page
+        if slot == 0 and i > 0:
+            pdf.showPage()
+        col, line = slot % LABEL_COLUMNS, slot // LABEL_COLUMNS
+        x = LABEL_MARGIN + col * label_width
+        y = page_height - LABEL_MARGIN - (line + 1) * label_height
+        draw_label(pdf, x, y, label_width, label_height, row._asdict(),
+                   symbols[codes[i]])
+    pdf.save()
+    return len(codes)
+
+
+def export_label_pdf(df):
+    """Gera as etiquetas e devolve o PDF (o arquivo temporário é removido)"""
+    fd, path = tempfile.mkstemp(prefix="etiquetas_", suffix=".pdf")
+    os.close(fd)
+    try:
+        write_label_pdf(path, df)
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def category_codes_for(series, values):
+    """Códigos inteiros das categorias informadas (ignora inexistentes)"""
+    categories = series.cat.categories
+    return [categories.get_loc(value) for value in values
+            if value in categories]
+
+
+def build_avanco_partition(df):
+    """Pré-calcula as posições das linhas de cada avanço do catálogo"""
+    return df.groupby('avanco', sort=False, observed=True).indices
+
+
+class CatalogSearchIndex:
+    """Índice de busca por substring (trigramas) sobre IDs e etapas"""
+
+    MAX_CACHED_QUERIES = 32
+
+    def __init__(self, df):
+        self._df = df
+        self._lock = threading.Lock()
+        self._built = False
+        self._results = OrderedDict()
+
+    def _build(self):
+        """Monta o índice invertido na primeira busca"""
+        # IDs vazios (nulos) não entram no índice
+        ids = self._df['id_codigo'].fillna('').str.lower().to_numpy(
+            dtype=object)
+        postings = {}
+        for position, value in enumerate(ids):
+            for gram in {value[i:i + 3] for i in range(len(value) - 2)}:
+                postings.setdefault(gram, []).append(position)
+        self._ids = ids
+        self._short_ids = [position for position, value in enumerate(ids)
+                           if value and len(value) < 3]
+        self._trigrams = {gram: np.asarray(positions, dtype=np.intp)
+                          for gram, positions in postings.items()}
+
+        etapas = self._df['etapa_programa']
+        self._etapa_names = [str(name).lower()
+                             for name in etapas.cat.categories]
+        self._etapa_positions = pd.Series(
+            np.arange(len(etapas))).groupby(
+                etapas.cat.codes.to_numpy()).indices
+        self._built = True
+
+    def _search_ids(self, query):
+        """Posições dos IDs que contêm o termo"""
+        if len(query) < 3:
+            # Termo curto: união das listas dos trigramas que o contêm,
+            # mais os IDs com menos de 3 caracteres (fora do índice)
+            parts = [positions for gram, positions in self._trigrams.items()
+                     if query in gram]
+            parts.append(np.asarray(
+                [p for p in self._short_ids if query in self._ids[p]],
+                dtype=np.intp))
+            return self._union(parts)
+
+        grams = sorted({query[i:i + 3] for i in range(len(query) - 2)},
+                       key=lambda gram: len(self._trigrams.get(gram, ())))
+        candidates = self._trigrams.get(grams[0])
+        if candidates is None:
+            return np.empty(0, dtype=np.intp)
+        for gram in grams[1:]:
+            candidates = np.intersect1d(
+                candidates, self._trigrams.get(gram, ()), assume_unique=True)
+            if not len(candidates):
+                return candidates
+        if len(query) == 3:
+            return candidates
+        # Confirma a substring completa apenas nos candidatos
+        return np.asarray([p for p in candidates if query in self._ids[p]],
+                          dtype=np.intp)
+
+    def _search_etapas(self, query):
+        """Posições das linhas cujas etapas contêm o termo"""
+        return self._union([self._etapa_positions[code]
+                            for code, name in enumerate(self._etapa_names)
+                            if query in name and code in self._etapa_positions])
+
+    def _union(self, parts):
+        """União ordenada de listas de posições (máscara booleana)"""
+        mask = np.zeros(len(self._ids), dtype=bool)
+        for positions in parts:
+            mask[positions] = True
+        return np.flatnonzero(mask)
+
+    def search(self, term):
+        """Posições (ordenadas) das linhas que contêm o termo no ID ou etapa"""
+        query = str(term).strip().lower()
+        with self._lock:
+            if not self._built:
+                self._build()
+            cached = self._results.get(query)
+            if cached is not None:
+                self._results.move_to_end(query)
+                return cached
+
+        if not query:
+            positions = np.arange(len(self._df))
+        else:
+            positions = self._union([self._search_ids(query),
+                                     self._search_etapas(query)])
+
+        with self._lock:
+            self._results[query] = positions
+            while len(self._results) > self.MAX_CACHED_QUERIES:
+                self._results.popitem(last=False)
+        return positions
+
 
-    # Garantir que colunas críticas existam e tratar valores nulos
-    if 'avanco' in filtered_df.columns:
-        filtered_df['avanco'] = filtered_df['avanco'].fillna('').astype(str)
-    if 'trait' in filtered_df.columns:
-        filtered_df['trait'] = filtered_df['trait'].fillna('N/A').astype(str)
-    if 'id_codigo' in filtered_df.columns:
-        filtered_df['id_codigo'] = filtered_df['id_codigo'].astype(str)
+@timed('filter_materials')
+def filter_positions(df, avanco_filter=None, id_search=None,
+                     avanco_partition=None, search_index=None):
+    """Posições no catálogo dos materiais filtrados (None = todos)"""
+    positions = None
 
     if avanco_filter and avanco_filter != "Todos":
-        filtered_df = filtered_df[filtered_df['avanco'] == avanco_filter]
+        if avanco_partition is None:
+            avanco_partition = build_avanco_partition(df)
+        positions = avanco_partition.get(
+            avanco_filter, np.empty(0, dtype=np.intp))
+
+    if id_search and search_index is not None:
+        # Índice pré-construído: posições no catálogo completo
+        found = search_index.search(id_search)
+        positions = found if positions is None else np.intersect1d(
+            positions, found, assume_unique=True)
+    elif id_search:
+        base = np.arange(len(df)) if positions is None else positions
+        subset = df.take(base)
+        mask = subset['id_codigo'].str.contains(
+            str(id_search), case=False, na=False).to_numpy(dtype=bool)
+        # Busca só nas categorias de etapa e depois compara códigos
+        etapas = subset['etapa_programa'].cat.categories
+        matching = etapas[etapas.str.contains(
+            str(id_search), case=False, regex=False)]
+        mask = mask | np.isin(
+            subset['etapa_programa'].cat.codes.to_numpy(),
+            category_codes_for(subset['etapa_programa'], matching))
+        positions = base[mask]
+
+    return positions
+
+
+def filter_materials(df, avanco_filter=None, id_search=None,
+                     avanco_partition=None, search_index=None):
+    """Filtra os materiais baseado nos critérios selecionados"""
+    # Colunas já normalizadas na carga: sem cópia nem nova conversão.
+    # O resultado pode ser o próprio catálogo e não deve ser modificado.
+    positions = filter_positions(df, avanco_filter, id_search,
+                                 avanco_partition, search_index)
+    if positions is None:
+        return df
+    return df.take(positions)
 
-    if id_search:
-        mask = filtered_df['id_codigo'].str.contains(
-            str(id_search), case=False, na=False)
-        if 'etapa_programa' in filtered_df.columns:
-            mask |= filtered_df['etapa_programa'].astype(str).str.contains(
-                str(id_search), case=False, na=False)
-        filtered_df = filtered_df[mask]
 
-    return filtered_df
+def scope_mask(n_rows, positions):
+    """Máscara das linhas do catálogo dentro do filtro (None = todas)"""
+    if positions is None:
+        return None
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[positions] = True
+    return mask
+
+
+class CatalogIdIndex:
+    """Índice id_codigo -> posição no catálogo completo
+
+    IDs únicos ficam num dict simples; só os repetidos guardam arrays de
+    posições. Construído uma vez por catálogo, vale para qualquer filtro.
+    """
+
+    def __init__(self, df):
+        ids = df['id_codigo'].tolist()
+        self.positions = dict(zip(ids, range(len(ids))))
+        self.duplicates = {}
+        if len(self.positions) < len(ids):
+            id_values = df['id_codigo'].to_numpy()
+            repeated = np.flatnonzero(
+                df['id_codigo'].duplicated(keep=False).to_numpy())
+            groups = pd.Series(repeated).groupby(id_values[repeated],
+                                                 sort=False).indices
+            self.duplicates = {material_id: repeated[idx]
+                               for material_id, idx in groups.items()}
+
+    def lookup(self, material_id, scope=None):
+        """Posições do ID (restritas ao filtro, se houver) ou None"""
+        positions = self.duplicates.get(material_id)
+        if positions is None:
+            position = self.positions.get(material_id)
+            if position is None:
+                return None
+            positions = np.array([position])
+        if scope is not None:
+            positions = positions[scope[positions]]
+        return positions if len(positions) else None
+
+    def __len__(self):
+        return len(self.positions)
+
+
+def build_id_index(df):
+    """Cria índice id_codigo -> posições das linhas para busca O(1)"""
+    return CatalogIdIndex(df)
+
+
+def find_material_rows(df, id_index, material_id, scope=None):
+    """Retorna todas as linhas do catálogo com o id_codigo informado"""
+    positions = id_index.lookup(material_id, scope)
+    if positions is None:
+        return df.iloc[0:0]
+    return df.iloc[positions]
+
+
+def match_scan(df, id_index, scan_id, quick_avanco, check_time=None,
+               scope=None):
+    """Aplica as regras de checagem a um código e devolve o registro"""
+    if check_time is None:
+        check_time = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+
+    material_matches = find_material_rows(df, id_index, scan_id, scope)
+    if material_matches.empty:
+        return {
+            'id_codigo': scan_id,
+            'etapa_programa': 'Não encontrado',
+            'trait': 'N/A',
+            'avanco': 'N/A',
+            'check_time': check_time,
+            'encontrado': 'Não'
+        }
+
+    # IDs duplicados: priorizar a linha com o avanço procurado
+    if len(material_matches) > 1:
+        same_avanco = material_matches[material_matches['avanco']
+                                       == quick_avanco]
+        if not same_avanco.empty:
+            material_matches = same_avanco
+    material_row = material_matches.iloc[0]
+    current_material_avanco = material_row['avanco']
+
+    return {
+        'id_codigo': scan_id,
+        'etapa_programa': material_row.get('etapa_programa', 'Sem etapa'),
+        'trait': material_row.get('trait', 'Sem trait'),
+        'avanco': current_material_avanco,
+        'check_time': check_time,
+        # Avanço correto registra como encontrado; outro avanço é alertado
+        'encontrado': 'Sim' if current_material_avanco == quick_avanco
+        else 'Não - Avanço incorreto'
+    }
 
 
+@timed()
 def process_scan():
     """Callback executado quando o campo de scan muda"""
     scan_id = st.session_state.scanner_input
@@ -304,109 +1749,770 @@ def process_scan():
     if hasattr(st.session_state, 'last_processed') and st.session_state.last_processed == scan_id.strip():
         return
 
+    started = time.perf_counter()
     st.session_state.last_processed = scan_id.strip()
     scan_id_clean = scan_id.strip()
     current_time = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
 
     quick_avanco = st.session_state.get('current_quick_avanco', '')
     filtered_df = st.session_state.get('current_filtered_df', pd.DataFrame())
+    catalog_df = st.session_state.get('current_catalog_df')
+    id_index = st.session_state.get('catalog_id_index')
 
-    if filtered_df.empty:
+    if filtered_df.empty or catalog_df is None or id_index is None:
         return
 
-    # Procurar pelo id_codigo
-    material_matches = filtered_df[filtered_df['id_codigo'].astype(
-        str) == scan_id_clean]
-
-    if not material_matches.empty:
-        material_row = material_matches.iloc[0]
-        current_material_avanco = material_row['avanco']
-
-        if current_material_avanco == quick_avanco:
-            # Material encontrado com avanço correto - registrar automaticamente
-            st.session_state.check_history.append({
-                'id_codigo': scan_id_clean,
-                'etapa_programa': material_row.get('etapa_programa', 'Sem etapa'),
-                'trait': material_row.get('trait', 'Sem trait'),
-                'avanco': current_material_avanco,
-                'check_time': current_time,
-                'encontrado': 'Sim'
-            })
-
-            log_material_check(scan_id_clean, current_material_avanco, True)
-
-            # Auto-save no cache após cada registro
-            auto_save_history()
-
-            # Definir dados para o warning de sucesso
-            st.session_state.last_success = {
-                'id': scan_id_clean,
-                'etapa': material_row.get('etapa_programa', 'Sem etapa'),
-                'trait': material_row.get('trait', 'Sem trait'),
-                'avanco': current_material_avanco,
-                'time': current_time
-            }
-
-        else:
-            st.session_state.check_history.append({
-                'id_codigo': scan_id_clean,
-                'etapa_programa': material_row.get('etapa_programa', 'Sem etapa'),
-                'trait': material_row.get('trait', 'Sem trait'),
-                'avanco': current_material_avanco,
-                'check_time': current_time,
-                'encontrado': 'Não - Avanço incorreto'
-            })
-            log_material_check(scan_id_clean, current_material_avanco, False)
-            st.session_state.scan_error = f"Avanço incorreto! Esperado: {quick_avanco}, Atual: {current_material_avanco}"
+    # Procurar pelo id_codigo no índice do catálogo, dentro do filtro atual
+    record = match_scan(catalog_df, id_index, scan_id_clean, quick_avanco,
+                        current_time, st.session_state.get('current_scope'))
+    accepted = apply_duplicate_policy(
+        [record], st.session_state.scan_counters,
+        st.session_state.get('duplicate_policy', DEFAULT_DUPLICATE_POLICY))
+    if not accepted:
+        st.session_state.scan_error = f"Material '{scan_id_clean}' já registrado (leitura ignorada)"
+        st.session_state.scanner_input = ""
+        return
+    record = accepted[0]
+
+    # Registro no histórico com auto-save no cache
+    record_checks([record])
+    log_material_check(scan_id_clean, record['avanco'],
+                       record['encontrado'] == 'Sim',
+                       st.session_state.get('station_id', 'system'),
+                       result=record['encontrado'],
+                       latency_ms=(time.perf_counter() - started) * 1000)
+
+    if record['encontrado'] == 'Sim':
+        # Definir dados para o warning de sucesso
+        st.session_state.last_success = {
+            'id': scan_id_clean,
+            'etapa': record['etapa_programa'],
+            'trait': record['trait'],
+            'avanco': record['avanco'],
+            'time': current_time
+        }
+    elif record['encontrado'] == 'Duplicado':
+        st.session_state.scan_error = f"Material '{scan_id_clean}' já registrado (duplicado)"
+    elif record['encontrado'] == 'Não - Avanço incorreto':
+        st.session_state.scan_error = f"Avanço incorreto! Esperado: {quick_avanco}, Atual: {record['avanco']}"
     else:
-        st.session_state.check_history.append({
-            'id_codigo': scan_id_clean,
-            'etapa_programa': 'Não encontrado',
-            'trait': 'N/A',
-            'avanco': 'N/A',
-            'check_time': current_time,
-            'encontrado': 'Não'
-        })
-        log_material_check(scan_id_clean, 'N/A', False)
         st.session_state.scan_error = f"ID '{scan_id_clean}' não encontrado!"
 
     # Limpar campo de input automaticamente
     st.session_state.scanner_input = ""
 
 
-def load_excel_file(uploaded_file):
-    """Carrega o arquivo Excel e valida as colunas obrigatórias"""
-    try:
-        df = pd.read_excel(uploaded_file)
+def parse_scan_codes(text):
+    """Extrai os códigos de uma lista colada ou de um arquivo txt/csv"""
+    codes = []
+    for line in text.splitlines():
+        # Em CSV, o código é a primeira coluna da linha
+        code = line.replace(';', ',').split(',', 1)[0].strip().strip('"')
+        if code:
+            codes.append(code)
+    # Ignorar cabeçalho de CSV
+    if codes and codes[0].lower() == 'id_codigo':
+        codes = codes[1:]
+    return codes
+
+
+def classify_scans(df, codes, quick_avanco, check_time=None):
+    """Concilia vários códigos com o catálogo em uma única junção
+
+    Aplica as mesmas regras do process_scan: encontrado com o avanço
+    procurado ('Sim'), encontrado com outro avanço ('Não - Avanço
+    incorreto') ou não encontrado ('Não').
+    """
+    if check_time is None:
+        check_time = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+
+    scans = pd.DataFrame({'id_codigo': pd.Series(codes, dtype=str).str.strip()})
+    scans = scans[scans['id_codigo'] != '']
+
+    catalog = df.loc[df['id_codigo'].isin(scans['id_codigo']),
+                     ['id_codigo', 'etapa_programa', 'trait', 'avanco']]
+    catalog = catalog.astype(object)
+    # IDs duplicados: priorizar a linha com o avanço procurado
+    catalog = catalog.iloc[np.argsort(
+        (catalog['avanco'] != quick_avanco).to_numpy(), kind='stable')]
+    catalog = catalog.drop_duplicates('id_codigo', keep='first')
+
+    results = scans.merge(catalog, on='id_codigo', how='left')
+    found = results['avanco'].notna().to_numpy()
+    correct = found & (results['avanco'] == quick_avanco).to_numpy()
+
+    results['etapa_programa'] = results['etapa_programa'].where(
+        found, 'Não encontrado')
+    results['trait'] = results['trait'].where(found, 'N/A')
+    results['avanco'] = results['avanco'].where(found, 'N/A')
+    results['check_time'] = check_time
+    results['encontrado'] = np.select(
+        [correct, found], ['Sim', 'Não - Avanço incorreto'], 'Não')
+    return results[HISTORY_COLUMNS]
+
+
+@timed()
+def process_bulk_scans(codes):
+    """Concilia uma lista de códigos e registra tudo em um único lote"""
+    quick_avanco = st.session_state.get('current_quick_avanco', '')
+    filtered_df = st.session_state.get('current_filtered_df', pd.DataFrame())
+    if filtered_df.empty or not codes:
+        return None
 
-        # Colunas obrigatórias adaptadas para seu arquivo
-        required_columns = ['etapa_programa', 'id_codigo', 'avanco']
-        missing_columns = [
-            col for col in required_columns if col not in df.columns]
+    results = classify_scans(filtered_df, codes, quick_avanco)
+    records = apply_duplicate_policy(
+        results.to_dict('records'), st.session_state.scan_counters,
+        st.session_state.get('duplicate_policy', DEFAULT_DUPLICATE_POLICY))
+    results = pd.DataFrame(records, columns=HISTORY_COLUMNS)
+    # Uma única gravação no journal para o lote inteiro
+    record_checks(records)
+    for record in records:
+        log_material_check(record['id_codigo'], record['avanco'],
+                           record['encontrado'] == 'Sim',
+                           st.session_state.get('station_id', 'system'),
+                           result=record['encontrado'])
+    return results
+
+
+# Cache de catálogos já processados, compartilhado entre sessões e chaveado
+# pelo hash do conteúdo do arquivo (evita reler o Excel a cada rerun)
+CATALOG_CACHE_MAX_ENTRIES = 4
+
+# Colunas obrigatórias adaptadas para seu arquivo
+REQUIRED_COLUMNS = ['etapa_programa', 'id_codigo', 'avanco']
+
+# Formatos aceitos; Excel é convertido para Parquet (chave = hash do conteúdo)
+CATALOG_EXTENSIONS = ['xlsx', 'xls', 'csv', 'parquet', 'feather']
+# Codificações tentadas em ordem na leitura de CSV (latin-1 aceita tudo)
+CSV_ENCODINGS = ('utf-8', 'cp1252', 'latin-1')
+PARQUET_CACHE_DIR = os.path.join(CACHE_DIR, "catalogos")
+PARQUET_CACHE_MAX_FILES = 20
+# Versão do formato convertido (muda quando a leitura do Excel muda)
+PARQUET_CACHE_VERSION = 2
+
+# Colunas categóricas do catálogo e o valor usado para nulos
+CATEGORY_COLUMNS = {'avanco': '', 'trait': 'N/A', 'etapa_programa': ''}
+
+# Colunas lidas do arquivo (demais só se o usuário escolher) e seus tipos
+KNOWN_COLUMNS = REQUIRED_COLUMNS + ['trait']
+CATALOG_DTYPES = {
+    'id_codigo': 'string',
+    'etapa_programa': 'category',
+    'avanco': 'category',
+    'trait': 'category'
+}
+
+
+def file_content_hash(uploaded_file):
+    """Calcula o hash SHA-256 do conteúdo do arquivo enviado"""
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+
+def _fill_text(series, fill_value):
+    """Preenche nulos e garante texto, preservando colunas categóricas"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Categorias numéricas (ex.: avanço 0/1) passam a ser texto
+        if not pd.api.types.is_string_dtype(series.cat.categories):
+            series = series.cat.rename_categories(
+                series.cat.categories.astype(str))
+        if series.isna().any():
+            if fill_value not in series.cat.categories:
+                series = series.cat.add_categories([fill_value])
+            series = series.fillna(fill_value)
+        return series
+    return series.fillna(fill_value).astype(str)
+
+
+def normalize_catalog(df):
+    """Trata valores nulos e tipos das colunas críticas do catálogo"""
+    # Colunas de baixa cardinalidade ficam como categorias (códigos inteiros)
+    for col, fill_value in CATEGORY_COLUMNS.items():
+        if not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+        df[col] = _fill_text(df[col], fill_value)
+    # ID vazio vira '' (já apontado na validação); com pandas 3 o astype
+    # manteria NaN
+    df['id_codigo'] = df['id_codigo'].fillna('').astype(str)
+    return df
+
+
+def catalog_extension(uploaded_file):
+    """Extensão (sem ponto, minúscula) do arquivo de catálogo"""
+    return os.path.splitext(uploaded_file.name)[1].lower().lstrip('.')
+
+
+def catalog_dtypes(columns):
+    """Tipos declarados na leitura para as colunas selecionadas"""
+    return {col: dtype for col, dtype in CATALOG_DTYPES.items()
+            if col in columns}
+
+
+def project_columns(available_columns, extra_columns):
+    """Colunas a carregar: conhecidas + extras escolhidas pelo usuário"""
+    wanted = set(KNOWN_COLUMNS) | set(extra_columns or [])
+    return [col for col in available_columns if col in wanted]
+
+
+def prune_parquet_cache():
+    """Mantém apenas os arquivos Parquet convertidos mais recentes"""
+    files = [os.path.join(PARQUET_CACHE_DIR, name)
+             for name in os.listdir(PARQUET_CACHE_DIR)
+             if name.endswith('.parquet')]
+    files.sort(key=os.path.getmtime, reverse=True)
+    for path in files[PARQUET_CACHE_MAX_FILES:]:
+        os.remove(path)
+
+
+def parquet_cache_path(content_hash):
+    """Arquivo Parquet convertido de um Excel (pelo hash do conteúdo)"""
+    return os.path.join(PARQUET_CACHE_DIR,
+                        f"{content_hash}.v{PARQUET_CACHE_VERSION}.parquet")
+
+
+def save_parquet_cache(df, content_hash):
+    """Salva o catálogo lido do Excel em Parquet para as próximas sessões"""
+    try:
+        os.makedirs(PARQUET_CACHE_DIR, exist_ok=True)
+        parquet_path = parquet_cache_path(content_hash)
+        # Colunas mistas (ex.: números e textos) são gravadas como texto
+        parquet_df = df.copy()
+        for col in parquet_df.columns[parquet_df.dtypes == object]:
+            parquet_df[col] = parquet_df[col].astype('string')
+
+        tmp_path = parquet_path + ".tmp"
+        parquet_df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, parquet_path)
+        prune_parquet_cache()
+    except Exception as e:
+        logging.warning(f"Não foi possível salvar o catálogo em Parquet: {str(e)}")
+
+
+def read_parquet_projected(source, extra_columns):
+    """Lê só as colunas necessárias de um arquivo Parquet"""
+    import pyarrow.parquet as pq
+
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    available_columns = pq.read_schema(source).names
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    df = pd.read_parquet(
+        source, columns=project_columns(available_columns, extra_columns))
+    return df.astype(catalog_dtypes(df.columns)), available_columns
+
+
+def read_feather_projected(source, extra_columns):
+    """Lê só as colunas necessárias de um arquivo Feather"""
+    import pyarrow.ipc
+
+    source.seek(0)
+    available_columns = pyarrow.ipc.open_file(source).schema.names
+    source.seek(0)
+    df = pd.read_feather(
+        source, columns=project_columns(available_columns, extra_columns))
+    return df.astype(catalog_dtypes(df.columns)), available_columns
+
+
+def read_csv_projected(source, extra_columns):
+    """Lê só as colunas necessárias do CSV, com tipos declarados"""
+    # Planilhas exportadas em pt-BR costumam usar ';' como separador e,
+    # vindas do Excel, a codificação cp1252 em vez de UTF-8
+    header = source.getvalue()[:4096].split(b'\n', 1)[0]
+    sep = ';' if header.count(b';') > header.count(b',') else ','
+
+    for encoding in CSV_ENCODINGS:
+        try:
+            source.seek(0)
+            available_columns = list(pd.read_csv(
+                source, sep=sep, nrows=0, encoding=encoding).columns)
+            columns = project_columns(available_columns, extra_columns)
+            source.seek(0)
+            df = pd.read_csv(source, sep=sep, usecols=columns,
+                             dtype=catalog_dtypes(columns), encoding=encoding)
+            return df, available_columns
+        except UnicodeDecodeError:
+            if encoding == CSV_ENCODINGS[-1]:
+                raise
+
+
+def read_excel_cached(uploaded_file, content_hash, extra_columns):
+    """Lê o Excel, usando a conversão Parquet em cache quando existir"""
+    parquet_path = parquet_cache_path(content_hash)
+    if os.path.exists(parquet_path):
+        try:
+            return read_parquet_projected(parquet_path, extra_columns)
+        except Exception as e:
+            logging.warning(f"Erro ao ler Parquet em cache: {str(e)}")
+
+    # Primeira leitura: planilha completa para a conversão em Parquet.
+    # Tipos declarados já na leitura: uma célula vazia não transforma os
+    # IDs em float ('1001.0')
+    uploaded_file.seek(0)
+    df = pd.read_excel(uploaded_file, dtype=CATALOG_DTYPES)
+    save_parquet_cache(df, content_hash)
+
+    available_columns = list(df.columns)
+    df = df[project_columns(available_columns, extra_columns)]
+    return df.astype(catalog_dtypes(df.columns)), available_columns
+
+
+def read_catalog_file(uploaded_file, content_hash, extra_columns=None):
+    """Lê o catálogo de acordo com o formato, só com as colunas usadas"""
+    extension = catalog_extension(uploaded_file)
+    if extension == 'csv':
+        return read_csv_projected(uploaded_file, extra_columns)
+    if extension == 'parquet':
+        return read_parquet_projected(uploaded_file, extra_columns)
+    if extension == 'feather':
+        return read_feather_projected(uploaded_file, extra_columns)
+    return read_excel_cached(uploaded_file, content_hash, extra_columns)
+
+
+def parse_catalog(uploaded_file, content_hash, extra_columns=None):
+    """Lê o arquivo, valida as colunas e devolve o catálogo normalizado"""
+    df, available_columns = read_catalog_file(
+        uploaded_file, content_hash, extra_columns)
+
+    missing_columns = [
+        col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing_columns:
+        return {'df': None, 'issues': [], 'missing_columns': missing_columns,
+                'available_columns': available_columns}
+
+    # Adicionar coluna trait se não existir (para compatibilidade)
+    if 'trait' not in df.columns:
+        df['trait'] = 'N/A'
+
+    issues = validate_excel_data(df)
+    df = normalize_catalog(df)
+    return {'df': df, 'issues': issues, 'missing_columns': [],
+            'available_columns': available_columns,
+            'avanco_partition': build_avanco_partition(df),
+            'search_index': CatalogSearchIndex(df),
+            'id_index': build_id_index(df)}
+
+
+# O `streamlit run` reexecuta o script como um novo __main__ a cada rerun:
+# o cache fica no st.cache_resource, que sobrevive entre execuções
+@st.cache_resource(max_entries=CATALOG_CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_catalog_entry(content_hash, extra_columns, _uploaded_file):
+    """Catálogo processado por (hash, colunas extras), compartilhado (LRU)"""
+    entry = parse_catalog(_uploaded_file, content_hash, list(extra_columns))
+    entry['hash'] = content_hash
+    entry['key'] = (content_hash, extra_columns)
+    return entry
+
+
+def get_cached_catalog(uploaded_file, extra_columns=None):
+    """Devolve o catálogo processado do cache ou processa e armazena"""
+    return cached_catalog_entry(file_content_hash(uploaded_file),
+                                tuple(sorted(extra_columns or [])),
+                                uploaded_file)
+
+
+@timed()
+def load_excel_file(uploaded_file, extra_columns=None):
+    """Carrega o catálogo (Excel, CSV, Parquet ou Feather) e valida as colunas obrigatórias"""
+    try:
+        entry = get_cached_catalog(uploaded_file, extra_columns)
+        st.session_state.catalog_columns = entry['available_columns']
 
-        if missing_columns:
+        if entry['missing_columns']:
             st.error(
-                f"Colunas obrigatórias não encontradas: {missing_columns}")
+                f"Colunas obrigatórias não encontradas: {entry['missing_columns']}")
             st.info(
                 "O arquivo deve conter pelo menos as colunas: 'etapa_programa', 'id_codigo' e 'avanco'")
             return None
 
-        # Adicionar coluna trait se não existir (para compatibilidade)
-        if 'trait' not in df.columns:
-            df['trait'] = 'N/A'
-
-        issues = validate_excel_data(df)
-        if issues:
+        if entry['issues']:
             st.warning("⚠️ Problemas encontrados nos dados:")
-            for issue in issues:
+            for issue in entry['issues']:
                 st.write(f"• {issue}")
-        return df
+
+        st.session_state.catalog_key = entry['key']
+        st.session_state.avanco_partition = entry['avanco_partition']
+        st.session_state.search_index = entry['search_index']
+        st.session_state.catalog_id_index = entry['id_index']
+
+        # O DataFrame é compartilhado pelo cache: não deve ser modificado
+        return entry['df']
 
     except Exception as e:
         st.error(f"Erro ao carregar arquivo: {str(e)}")
         return None
 
 
+SCANNER_LABEL = "📱 Digite ou escaneie o código do material:"
+
+# Mantém o foco no campo do scanner reagindo só a eventos relevantes.
+# Os listeners ficam na página e o registro é idempotente entre reruns.
+SCANNER_FOCUS_SCRIPT = """
+<script>
+(function () {
+    const doc = window.document;
+    const current = window.__scannerFocus;
+    if (current && current.label === %(label)s) {
+        return;
+    }
+    if (current) {
+        current.detach();
+    }
+
+    const selector = 'input[aria-label="' + %(label)s + '"]';
+    const editable = 'input, textarea, select, [contenteditable="true"], [role="combobox"], [role="listbox"]';
+    let pending = false;
+
+    function focusScanner() {
+        pending = false;
+        const active = doc.activeElement;
+        // Não tirar o foco de outro campo que o operador esteja usando
+        if (active && active !== doc.body && active.matches(editable)) {
+            return;
+        }
+        const input = doc.querySelector(selector);
+        if (input && !input.disabled) {
+            input.focus({ preventScroll: true });
+        }
+    }
+
+    function schedule() {
+        if (!pending) {
+            pending = true;
+            window.requestAnimationFrame(focusScanner);
+        }
+    }
+
+    function onKeydown(e) {
+        // Leitor de código de barras digitando sem foco em nenhum campo
+        if (doc.activeElement === doc.body && e.key && e.key.length === 1 &&
+                !e.ctrlKey && !e.metaKey && !e.altKey) {
+            focusScanner();
+        }
+    }
+
+    function onFocusout(e) {
+        if (!e.relatedTarget) {
+            schedule();
+        }
+    }
+
+    function onVisibility() {
+        if (doc.visibilityState === 'visible') {
+            schedule();
+        }
+    }
+
+    const listeners = [
+        ['focusout', onFocusout],
+        ['keydown', onKeydown],
+        ['pointerup', schedule],
+        ['visibilitychange', onVisibility]
+    ];
+    listeners.forEach(([type, fn]) => doc.addEventListener(type, fn, true));
+
+    window.__scannerFocus = {
+        label: %(label)s,
+        detach: function () {
+            listeners.forEach(([type, fn]) => doc.removeEventListener(type, fn, true));
+        }
+    };
+    schedule();
+})();
+</script>
+"""
+
+
+def scanner_focus_keeper(label=SCANNER_LABEL):
+    """Injeta o script de foco do scanner (sem polling nem MutationObserver)"""
+    st.html(SCANNER_FOCUS_SCRIPT % {'label': json.dumps(label)},
+            unsafe_allow_javascript=True)
+
+
+# Intervalo de atualização automática dos painéis pesados (histórico, etapas)
+PANEL_REFRESH_SECONDS = 15
+
+
+@st.fragment
+@timed()
+def render_scanner_panel(quick_avanco):
+    """Scanner, feedback e contadores de progresso
+
+    Executado como fragmento: o callback do campo de scan só redesenha esta
+    região, sem recalcular CSS, cache, cards e tabelas do restante da página.
+    """
+    # Status do scanner
+    st.markdown(
+        f'<div class="scanner-status" style="background: #f8f9fa; color: #1e293b;">🔍 Scanner Ativo - Procurando: {quick_avanco}</div>', unsafe_allow_html=True)
+
+    # Mostrar warning de sucesso expandido
+    if st.session_state.last_success:
+        visual_feedback("found", st.session_state.last_success)
+
+        # Auto-limpar após 3 segundos
+        import time
+        if 'success_time' not in st.session_state:
+            st.session_state.success_time = time.time()
+        elif time.time() - st.session_state.success_time > 3:
+            st.session_state.last_success = None
+            if 'success_time' in st.session_state:
+                del st.session_state.success_time
+
+    # Mostrar mensagens de erro
+    if st.session_state.scan_error:
+        if "já registrado" in st.session_state.scan_error:
+            visual_feedback("duplicate")
+        elif "Avanço incorreto" in st.session_state.scan_error:
+            visual_feedback("warning")
+        else:
+            visual_feedback("error")
+
+        # Auto-limpar erro após mostrar
+        st.session_state.scan_error = None
+
+    # Campo de input principal (sempre disponível) com auto-focus
+    scan_id = st.text_input(
+        SCANNER_LABEL,
+        key="scanner_input",
+        placeholder="ID do material...",
+        help="⚡ Registro automático ao encontrar material",
+        on_change=process_scan
+    )
+
+    # Conciliação em lote (coletor descarregado, lista colada etc.)
+    with st.expander("📦 Conciliação em Lote", expanded=False):
+        bulk_text = st.text_area(
+            "Cole os códigos (um por linha):", key="bulk_codes",
+            height=150)
+        bulk_file = st.file_uploader(
+            "Ou carregue um arquivo de códigos", type=['txt', 'csv'],
+            key="bulk_file")
+
+        if st.button("⚡ Conciliar Lote", width='stretch'):
+            codes = parse_scan_codes(bulk_text or "")
+            if bulk_file is not None:
+                codes += parse_scan_codes(
+                    bulk_file.getvalue().decode('utf-8-sig', errors='replace'))
+
+            results = process_bulk_scans(codes)
+            if results is None:
+                st.warning("Nenhum código informado")
+            else:
+                status_counts = results['encontrado'].value_counts()
+                col_ok, col_wrong, col_missing = st.columns(3)
+                col_ok.metric("✅ Encontrados",
+                              int(status_counts.get('Sim', 0)))
+                col_wrong.metric("⚠️ Avanço incorreto", int(
+                    status_counts.get('Não - Avanço incorreto', 0)))
+                col_missing.metric("❌ Não encontrados",
+                                   int(status_counts.get('Não', 0)))
+
+                problems = results[results['encontrado'] != 'Sim']
+                if not problems.empty:
+                    st.dataframe(problems, width='stretch',
+                                 hide_index=True)
+
+    # Estatísticas da checagem
+    if not st.session_state.check_history:
+        return
+
+    st.markdown("---")
+    st.markdown("### 📈 Estatísticas da Checagem")
+
+    # Totais pré-calculados por catálogo e contadores incrementais
+    totals = st.session_state.current_totals
+    counters = st.session_state.scan_counters
+    total_materials_avanco = totals['by_avanco'][quick_avanco]
+    encontrados = counters['by_avanco'][(quick_avanco, 'found')]
+    faltantes = total_materials_avanco - encontrados
+
+    # Progress bar
+    if total_materials_avanco > 0:
+        progress = min(encontrados / total_materials_avanco, 1.0)
+        st.progress(
+            progress, text=f"Progresso: {encontrados}/{total_materials_avanco} ({progress:.1%})")
+
+    # Métricas em cards
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        st.markdown(f"""
+        <div class="metric-card">
+            <div class="metric-label">Total com Avanço</div>
+            <div class="metric-value" style="color: #3b82f6">{total_materials_avanco}</div>
+        </div>
+        """, unsafe_allow_html=True)
+
+    with col2:
+        st.markdown(f"""
+        <div class="metric-card">
+            <div class="metric-label">Verificados</div>
+            <div class="metric-value" style="color: #1d4ed8">{encontrados}</div>
+        </div>
+        """, unsafe_allow_html=True)
+
+    with col3:
+        st.markdown(f"""
+        <div class="metric-card">
+            <div class="metric-label">Faltantes</div>
+            <div class="metric-value" style="color: #2563eb">{faltantes}</div>
+        </div>
+        """, unsafe_allow_html=True)
+
+    # Progresso agregado de todas as estações (backend SQLite)
+    shared_found = get_history_backend().progress(quick_avanco)
+    if shared_found is not None and total_materials_avanco > 0:
+        st.progress(
+            min(shared_found / total_materials_avanco, 1.0),
+            text=f"Todas as estações: {shared_found}/{total_materials_avanco}")
+
+
+@st.fragment(run_every=PANEL_REFRESH_SECONDS)
+@timed()
+def render_history_panel(filtered_df, quick_avanco):
+    """Painéis pesados, atualizados pelo timer ou sob demanda (não a cada leitura)"""
+    if not st.session_state.check_history:
+        return
+
+    st.markdown("---")
+    # Clicar em um widget do fragmento já o redesenha
+    st.button("🔄 Atualizar Painéis", key="refresh_panels",
+              help=f"Atualização automática a cada {PANEL_REFRESH_SECONDS}s")
+
+    if quick_avanco:
+        totals = st.session_state.current_totals
+        counters = st.session_state.scan_counters
+
+        # Progresso por etapa a partir dos mesmos contadores
+        with st.expander("🗂️ Progresso por Etapa", expanded=False):
+            st.dataframe(
+                etapa_progress_matrix(totals, counters, quick_avanco),
+                width='stretch',
+                hide_index=True,
+                column_config={
+                    'Progresso': st.column_config.ProgressColumn(
+                        'Progresso', format="%.1f%%",
+                        min_value=0.0, max_value=100.0)
+                }
+            )
+
+    # Histórico detalhado
+    with st.expander("📋 Histórico Detalhado de Checagens", expanded=True):
+        history = st.session_state.check_history
+
+        # Paginação no servidor: só a página atual vai ao navegador
+        col_size, col_page = st.columns(2)
+        with col_size:
+            page_size = st.selectbox(
+                "Registros por página:", HISTORY_PAGE_SIZES,
+                index=HISTORY_PAGE_SIZES.index(HISTORY_DEFAULT_PAGE_SIZE),
+                key="history_page_size")
+        total_pages = max(1, -(-len(history) // page_size))
+        with col_page:
+            page = st.number_input(
+                "Página (mais recentes primeiro):", min_value=1,
+                max_value=total_pages, value=1, step=1,
+                key="history_page")
+
+        positions = history_page_positions(
+            len(history), page - 1, page_size)
+        history_df = history.to_frame(positions)
+        st.caption(
+            f"Mostrando {len(history_df)} de {len(history)} checagens "
+            f"(página {page}/{total_pages})")
+
+        # Aplicar estilo vetorizado apenas à coluna de status
+        styled_df = history_df.style.apply(
+            history_status_styles, axis=None)
+        st.dataframe(styled_df, width='stretch',
+                     hide_index=True,
+                     column_config={
+                         'check_time': st.column_config.DatetimeColumn(
+                             'check_time', format="DD/MM/YYYY HH:mm:ss")
+                     })
+
+    # Consulta ao histórico compartilhado entre estações
+    if get_history_backend().name == 'sqlite':
+        with st.expander("🔎 Consultar Histórico Compartilhado", expanded=False):
+            query_id = st.text_input("ID do material:",
+                                     key="shared_query_id")
+            query_date = st.date_input("A partir de:", value=None,
+                                       key="shared_query_date")
+            if query_id or query_date:
+                since = datetime.combine(query_date, datetime.min.time()) \
+                    if query_date else None
+                st.dataframe(
+                    get_history_backend().query(
+                        id_codigo=query_id.strip() or None, since=since),
+                    width='stretch', hide_index=True)
+
+    # Controles e ações
+    st.markdown("### 🛠️ Controles do Sistema")
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        if st.button("🗑️ Limpar Histórico", width='stretch'):
+            st.session_state.check_history = HistoryStore()
+            st.session_state.scan_counters = new_scan_counters()
+            st.session_state.history_version += 1
+            # Limpar cache também
+            try:
+                get_history_backend().clear(
+                    st.session_state.station_id)
+            except:
+                pass
+            st.success("✅ Histórico e cache limpos!")
+            st.rerun()
+
+    with col2:
+        if st.button("🔄 Resetar Scanner", width='stretch'):
+            # Reset completo
+            reset_keys = ['scanner_input', 'last_processed', 'scan_error',
+                          'last_success']
+            for key in reset_keys:
+                if key == 'scan_error':
+                    st.session_state[key] = None
+                else:
+                    st.session_state[key] = "" if 'input' in key or 'processed' in key else None
+
+            st.success("✅ Scanner resetado!")
+            st.rerun()
+
+    with col3:
+        # Relatório gerado só sob demanda e reaproveitado enquanto
+        # catálogo/filtros e histórico não mudarem
+        report_key = (st.session_state.current_filter_key,
+                      st.session_state.history_version)
+        report_cache = st.session_state.report_cache
+
+        if report_cache and report_cache['key'] == report_key:
+            st.download_button(
+                label="📊 Exportar Relatório",
+                data=report_cache['data'],
+                file_name=report_cache['file_name'],
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                width='stretch'
+            )
+        elif st.button("📊 Gerar Relatório", width='stretch'):
+            with st.spinner("Gerando relatório..."):
+                st.session_state.report_cache = {
+                    'key': report_key,
+                    'data': export_report(
+                        filtered_df, st.session_state.check_history),
+                    'file_name': f"relatorio_checagem_etapas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+                }
+            st.rerun()
+
+        # Um relatório por etapa, gerados em paralelo e reunidos num zip só
+        # no clique do download (o fragmento roda a cada 15 s)
+        check_history = st.session_state.check_history
+        st.download_button(
+            label="🗂️ Exportar por Etapa (zip)",
+            data=lambda: export_split_report(filtered_df, check_history),
+            file_name=f"relatorios_por_etapa_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+            mime="application/zip", on_click="ignore",
+            width='stretch', disabled=xlsxwriter is None)
+
+
 def main():
     st.set_page_config(
         page_title="Material Checker Pro - Etapas de Programa",
@@ -732,6 +2838,16 @@ def main():
 
     # Inicializar sistema de logs
     setup_logging()
+    start_metrics_exporter()
+
+    # Identificação da estação/sessão para o histórico compartilhado: a
+    # estação é estável (URL ou máquina) para restaurar após recarregar a
+    # página; cada sessão do navegador é distinguida pelo session_id
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    if 'station_id' not in st.session_state:
+        st.session_state.station_id = st.query_params.get(
+            STATION_QUERY_PARAM, DEFAULT_STATION_ID)
 
     # Verificar e restaurar cache se disponível
     cached_data = restore_from_cache()
@@ -748,20 +2864,31 @@ def main():
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("📥 Restaurar", help="Restaurar dados do cache"):
-                    st.session_state.check_history = cached_data['history']
-                    st.success("✅ Dados restaurados do cache!")
-                    st.rerun()
+                    # Só aqui o histórico completo é desserializado
+                    restored = get_history_backend().load(
+                        st.session_state.station_id)
+                    if restored:
+                        st.session_state.check_history = HistoryStore(
+                            restored['history'])
+                        st.session_state.scan_counters = rebuild_scan_counters(
+                            restored['history'])
+                        st.session_state.history_version += 1
+                        st.success("✅ Dados restaurados do cache!")
+                        st.rerun()
+                    else:
+                        st.error("❌ Erro ao restaurar cache")
 
             with col2:
                 if st.button("🗑️ Limpar Cache", help="Apagar dados salvos"):
                     try:
-                        cache_path = os.path.join(
-                            "cache", "material_checker_cache.json")
-                        if os.path.exists(cache_path):
-                            os.remove(cache_path)
+                        cleared = get_history_backend().clear(
+                            st.session_state.station_id)
+                    except:
+                        cleared = False
+                    if cleared:
                         st.success("✅ Cache limpo!")
                         st.rerun()
-                    except:
+                    else:
                         st.error("❌ Erro ao limpar cache")
 
     # Header principal adaptado
@@ -774,26 +2901,37 @@ def main():
 
     # Inicializar estados da sessão
     session_defaults = {
-        'check_history': [],
+        'check_history': None,
         'show_animations': True,
         'scanner_input': "",
         'scan_error': None,
         'last_processed': "",
         'last_success': None,
-        'last_autosave': None
+        'last_autosave': None,
+        'history_version': 0,
+        'report_cache': None,
+        'scan_counters': None,
+        'duplicate_policy': DEFAULT_DUPLICATE_POLICY
     }
 
     for key, default in session_defaults.items():
         if key not in st.session_state:
             st.session_state[key] = default
 
+    if st.session_state.check_history is None:
+        st.session_state.check_history = HistoryStore()
+
+    if st.session_state.scan_counters is None:
+        st.session_state.scan_counters = rebuild_scan_counters(
+            st.session_state.check_history)
+
     # Sidebar configurações
     with st.sidebar:
         st.markdown("### 📁 Configurações do Sistema")
 
         uploaded_file = st.file_uploader(
-            "📄 Carregar Arquivo Excel",
-            type=['xlsx', 'xls'],
+            "📄 Carregar Catálogo (Excel, CSV, Parquet ou Feather)",
+            type=CATALOG_EXTENSIONS,
             help="Arquivo deve conter as colunas: 'etapa_programa', 'id_codigo' e 'avanco'"
         )
 
@@ -803,30 +2941,61 @@ def main():
                 value=st.session_state.show_animations
             )
 
+            st.selectbox(
+                "🔁 Leituras repetidas:", list(DUPLICATE_POLICIES),
+                format_func=DUPLICATE_POLICIES.get, key="duplicate_policy",
+                help="Como tratar materiais já confirmados nesta sessão")
+
+            st.text_input(
+                "🖥️ Estação:", key="station_id", on_change=remember_station,
+                help="Identifica esta estação no histórico compartilhado")
+
             # Status do auto-save
             if st.session_state.last_autosave:
                 st.success(f"💾 Último save: {st.session_state.last_autosave}")
             else:
                 st.info("💾 Auto-save ativo")
+            st.caption(f"Histórico: {get_history_backend().name}")
+
+        # Latência das operações instrumentadas (todas as sessões do processo)
+        with st.expander("⚡ Performance"):
+            summary = perf_summary()
+            if summary.empty:
+                st.caption("Nenhuma operação medida ainda")
+            else:
+                st.dataframe(summary, hide_index=True, width='stretch',
+                             column_config={
+                                 col: st.column_config.NumberColumn(format="%.1f")
+                                 for col in ['p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'Máx (ms)']
+                             })
+                st.caption(f"⚠️ p95 acima de {PERF_SLOW_THRESHOLD_MS} ms • "
+                           f"métricas em {METRICS_FILENAME} a cada "
+                           f"{METRICS_EXPORT_INTERVAL}s")
 
         # Processamento do arquivo
         df = None
         if uploaded_file is not None:
-            df = load_excel_file(uploaded_file)
+            # Catálogo já normalizado e cacheado pelo hash do conteúdo
+            df = load_excel_file(uploaded_file,
+                                 st.session_state.get('extra_columns', []))
             if df is not None:
-                # Tratamento imediato de dados para evitar erros de tipo
-                df['avanco'] = df['avanco'].fillna('').astype(str)
-                df['trait'] = df['trait'].fillna('N/A').astype(str)
-                df['id_codigo'] = df['id_codigo'].astype(str)
-                df['etapa_programa'] = df['etapa_programa'].fillna(
-                    '').astype(str)
-
                 st.success(f"✅ {len(df)} materiais carregados")
 
+                # Demais colunas do arquivo só são lidas se escolhidas
+                optional_columns = [
+                    col for col in st.session_state.get('catalog_columns', [])
+                    if col not in KNOWN_COLUMNS]
+                if optional_columns:
+                    st.multiselect(
+                        "Colunas extras:", optional_columns,
+                        key="extra_columns",
+                        help="Colunas adicionais do arquivo a carregar na lista de materiais")
+
                 st.markdown("#### 🔍 Filtros")
                 # Criar lista de avanços limpa
                 avanco_unique = [
-                    v for v in df['avanco'].unique() if v and v.strip()]
+                    v for v in category_counts(df['avanco']).index
+                    if v and v.strip()]
                 avanco_options = ["Todos"] + sorted(avanco_unique)
                 avanco_filter = st.selectbox("Avanço:", avanco_options)
                 search_term = st.text_input(
@@ -834,25 +3003,39 @@ def main():
             else:
                 st.error("❌ Erro no arquivo")
         else:
-            st.info("👆 Faça upload do arquivo Excel")
+            st.info("👆 Faça upload do arquivo do catálogo")
 
     # Área principal
     if df is not None:
-        # Aplicar filtros
-        filtered_df = filter_materials(df,
-                                       avanco_filter if 'avanco_filter' in locals() else None,
-                                       search_term if 'search_term' in locals() else None)
-
-        st.session_state.current_filtered_df = filtered_df
+        # Aplicar filtros só quando mudarem (o índice de IDs é do catálogo)
+        filter_key = (st.session_state.get('catalog_key'),
+                      avanco_filter if 'avanco_filter' in locals() else None,
+                      search_term if 'search_term' in locals() else None)
+
+        if st.session_state.get('current_filter_key') != filter_key:
+            positions = filter_positions(
+                df, filter_key[1], filter_key[2],
+                st.session_state.avanco_partition,
+                st.session_state.search_index)
+            filtered_df = df if positions is None else df.take(positions)
+            st.session_state.current_filtered_df = filtered_df
+            st.session_state.current_catalog_df = df
+            st.session_state.current_scope = scope_mask(len(df), positions)
+            st.session_state.current_totals = compute_catalog_totals(
+                filtered_df)
+            st.session_state.current_filter_key = filter_key
+        else:
+            filtered_df = st.session_state.current_filtered_df
 
         # Estatísticas em cards modernos
+        overview_started = time.perf_counter()
         st.markdown("### 📊 Visão Geral dos Materiais")
 
         # Estatísticas por avanço - já tratadas
-        avanco_counts = filtered_df['avanco'].value_counts()
+        avanco_counts = category_counts(filtered_df['avanco'])
 
         # Estatísticas por trait - já tratadas
-        trait_counts = filtered_df['trait'].value_counts()
+        trait_counts = category_counts(filtered_df['trait'])
 
         # Definir cores para traits
         trait_colors = {
@@ -908,16 +3091,45 @@ def main():
                     </div>
                     """, unsafe_allow_html=True)
 
+        record_timing('render_overview', time.perf_counter() - overview_started)
+
         # Tabela de materiais
         with st.expander(f"📋 Lista Completa ({len(filtered_df)} itens)", expanded=False):
-            st.dataframe(filtered_df, use_container_width=True,
-                         hide_index=True)
+            with perf_span('render_material_list'):
+                st.dataframe(filtered_df, width='stretch',
+                             hide_index=True)
+
+        # Etiquetas com código de barras para impressão
+        with st.expander("🏷️ Etiquetas com Código de Barras", expanded=False):
+            col_etapa, col_avanco = st.columns(2)
+            with col_etapa:
+                label_etapas = st.multiselect(
+                    "Etapas:", sorted(category_counts(
+                        filtered_df['etapa_programa']).index),
+                    key="label_etapas", help="Vazio = todas as etapas")
+            with col_avanco:
+                label_avanco = st.selectbox(
+                    "Avanço:", ["Todos"] + sorted(category_counts(
+                        filtered_df['avanco']).index), key="label_avanco")
+
+            label_df = filter_label_rows(
+                filtered_df, label_etapas,
+                None if label_avanco == "Todos" else label_avanco)
+            # PDF gerado só no clique do download (nada fica em disco nem é
+            # relido a cada rerun)
+            st.download_button(
+                label=f"🏷️ Baixar PDF ({len(label_df)} etiquetas)",
+                data=lambda: export_label_pdf(label_df),
+                file_name=f"etiquetas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+                mime="application/pdf", on_click="ignore",
+                width='stretch',
+                disabled=label_df.empty or barcode is None)
 
         # SEÇÃO DO SCANNER
         st.markdown('<div class="scanner-area">', unsafe_allow_html=True)
 
         # Usar valores já tratados do DataFrame
-        all_avancos = [v for v in filtered_df['avanco'].unique()
+        all_avancos = [v for v in category_counts(filtered_df['avanco']).index
                        if v and v.strip()]
         all_avancos = sorted(all_avancos)
 
@@ -929,214 +3141,16 @@ def main():
             )
             st.session_state.current_quick_avanco = quick_avanco
 
-            # Status do scanner
-            st.markdown(
-                f'<div class="scanner-status" style="background: #f8f9fa; color: #1e293b;">🔍 Scanner Ativo - Procurando: {quick_avanco}</div>', unsafe_allow_html=True)
-
-            # Mostrar warning de sucesso expandido
-            if st.session_state.last_success:
-                visual_feedback("found", st.session_state.last_success)
-
-                # Auto-limpar após 3 segundos
-                import time
-                if 'success_time' not in st.session_state:
-                    st.session_state.success_time = time.time()
-                elif time.time() - st.session_state.success_time > 3:
-                    st.session_state.last_success = None
-                    if 'success_time' in st.session_state:
-                        del st.session_state.success_time
-
-            # Mostrar mensagens de erro
-            if st.session_state.scan_error:
-                if "Avanço incorreto" in st.session_state.scan_error:
-                    visual_feedback("warning")
-                else:
-                    visual_feedback("error")
-
-                # Auto-limpar erro após mostrar
-                st.session_state.scan_error = None
-
-            # Campo de input principal (sempre disponível) com auto-focus
-            scan_id = st.text_input(
-                "📱 Digite ou escaneie o código do material:",
-                key="scanner_input",
-                placeholder="ID do material...",
-                help="⚡ Registro automático ao encontrar material",
-                on_change=process_scan
-            )
+            render_scanner_panel(quick_avanco)
 
-            # JavaScript para manter focus automático no campo
-            st.markdown("""
-            <script>
-            // Função para manter focus no input
-            function maintainFocus() {
-                const input = document.querySelector('input[aria-label="📱 Digite ou escaneie o código do material:"]');
-                if (input && document.activeElement !== input) {
-                    input.focus();
-                }
-            }
-            
-            // Manter focus quando a página carrega
-            document.addEventListener('DOMContentLoaded', function() {
-                setTimeout(maintainFocus, 100);
-            });
-            
-            // Manter focus continuamente (verifica a cada 500ms)
-            setInterval(maintainFocus, 500);
-            
-            // Refocar quando qualquer elemento perde o focus
-            document.addEventListener('blur', function(e) {
-                if (e.target.tagName === 'INPUT' || e.target.tagName === 'BUTTON') {
-                    setTimeout(maintainFocus, 100);
-                }
-            }, true);
-            
-            // Refocar após cliques
-            document.addEventListener('click', function() {
-                setTimeout(maintainFocus, 200);
-            });
-            
-            // Refocar após mudanças no DOM (quando Streamlit atualiza)
-            const observer = new MutationObserver(function(mutations) {
-                setTimeout(maintainFocus, 100);
-            });
-            
-            observer.observe(document.body, {
-                childList: true,
-                subtree: true
-            });
-            </script>
-            """, unsafe_allow_html=True)
+            # Foco automático no campo (registrado uma única vez no navegador)
+            scanner_focus_keeper()
 
         st.markdown('</div>', unsafe_allow_html=True)
 
-        # HISTÓRICO E ESTATÍSTICAS
-        if st.session_state.check_history:
-            st.markdown("---")
-
-            # Estatísticas da checagem
-            st.markdown("### 📈 Estatísticas da Checagem")
-
-            if 'quick_avanco' in locals():
-                total_materials_avanco = len(
-                    filtered_df[filtered_df['avanco'] == quick_avanco])
-                encontrados = len([h for h in st.session_state.check_history
-                                   if h['encontrado'] == 'Sim' and h['avanco'] == quick_avanco])
-                faltantes = total_materials_avanco - encontrados
-
-                # Progress bar
-                if total_materials_avanco > 0:
-                    progress = encontrados / total_materials_avanco
-                    st.progress(
-                        progress, text=f"Progresso: {encontrados}/{total_materials_avanco} ({progress:.1%})")
-
-                # Métricas em cards
-                col1, col2, col3 = st.columns(3)
-
-                with col1:
-                    st.markdown(f"""
-                    <div class="metric-card">
-                        <div class="metric-label">Total com Avanço</div>
-                        <div class="metric-value" style="color: #3b82f6">{total_materials_avanco}</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-
-                with col2:
-                    st.markdown(f"""
-                    <div class="metric-card">
-                        <div class="metric-label">Verificados</div>
-                        <div class="metric-value" style="color: #1d4ed8">{encontrados}</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-
-                with col3:
-                    st.markdown(f"""
-                    <div class="metric-card">
-                        <div class="metric-label">Faltantes</div>
-                        <div class="metric-value" style="color: #2563eb">{faltantes}</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-
-            # Histórico detalhado
-            with st.expander("📋 Histórico Detalhado de Checagens", expanded=True):
-                history_df = pd.DataFrame(st.session_state.check_history)
-
-                # Função para colorir status baseado no trait
-                def color_status_by_trait(row):
-                    styles = []
-                    for col in row.index:
-                        if col == 'encontrado':
-                            if row[col] == 'Sim':
-                                # Usar cor baseada no trait
-                                trait = row.get('trait', 'N/A')
-                                trait_colors = {
-                                    'CE3': 'background-color: #8b5cf6; color: white; font-weight: 700;',  # Roxo
-                                    'E3': 'background-color: #10b981; color: white; font-weight: 700;',   # Verde
-                                    'CONV': 'background-color: #f59e0b; color: white; font-weight: 700;'  # Laranja
-                                }
-                                styles.append(trait_colors.get(
-                                    trait, 'background-color: #10b981; color: white; font-weight: 700;'))
-                            elif 'incorreto' in str(row[col]):
-                                # Amarelo para avanço incorreto
-                                styles.append(
-                                    'background-color: #fef3c7; color: #92400e; font-weight: 600;')
-                            else:
-                                # Vermelho para não encontrado
-                                styles.append(
-                                    'background-color: #fef2f2; color: #dc2626; font-weight: 600;')
-                        else:
-                            styles.append('')
-                    return styles
-
-                # Aplicar estilo ao DataFrame
-                styled_df = history_df.style.apply(
-                    color_status_by_trait, axis=1)
-                st.dataframe(styled_df, use_container_width=True,
-                             hide_index=True)
-
-            # Controles e ações
-            st.markdown("### 🛠️ Controles do Sistema")
-            col1, col2, col3 = st.columns(3)
-
-            with col1:
-                if st.button("🗑️ Limpar Histórico", use_container_width=True):
-                    st.session_state.check_history = []
-                    # Limpar cache também
-                    try:
-                        cache_path = os.path.join(
-                            "cache", "material_checker_cache.json")
-                        if os.path.exists(cache_path):
-                            os.remove(cache_path)
-                    except:
-                        pass
-                    st.success("✅ Histórico e cache limpos!")
-                    st.rerun()
-
-            with col2:
-                if st.button("🔄 Resetar Scanner", use_container_width=True):
-                    # Reset completo
-                    reset_keys = ['scanner_input', 'last_processed', 'scan_error',
-                                  'last_success']
-                    for key in reset_keys:
-                        if key == 'scan_error':
-                            st.session_state[key] = None
-                        else:
-                            st.session_state[key] = "" if 'input' in key or 'processed' in key else None
-
-                    st.success("✅ Scanner resetado!")
-                    st.rerun()
-
-            with col3:
-                # Botão de exportação
-                report_data = export_report(
-                    filtered_df, st.session_state.check_history)
-                st.download_button(
-                    label="📊 Exportar Relatório",
-                    data=report_data,
-                    file_name=f"relatorio_checagem_etapas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True
-                )
+        # HISTÓRICO E ESTATÍSTICAS (atualizados fora do caminho da leitura)
+        render_history_panel(filtered_df,
+                             quick_avanco if 'quick_avanco' in locals() else None)
 
         # Footer profissional
         st.markdown("---")
@@ -1166,7 +3180,7 @@ def main():
             st.info("""
             **Passos para usar o sistema:**
             
-            1. 📁 Faça upload do arquivo Excel na barra lateral
+            1. 📁 Faça upload do arquivo Excel (ou CSV/Parquet/Feather) na barra lateral
             2. ✅ Certifique-se que contém as colunas: 'etapa_programa', 'id_codigo' e 'avanco'  
             3. ⚙️ Configure o avanço desejado para checagem
             4. 📱 Use o scanner ou digite os códigos manualmente
@@ -1214,5 +3228,377 @@ def main():
             """, unsafe_allow_html=True)
 
 
+# Execução sem interface (linha de comando)
+CLI_CHUNK_SIZE = 100000
+
+
+def open_catalog_source(path):
+    """Abre o catálogo do disco com a mesma interface do arquivo enviado"""
+    with open(path, 'rb') as f:
+        source = io.BytesIO(f.read())
+    source.name = os.path.basename(path)
+    return source
+
+
+def iter_scan_chunks(path, chunk_size=CLI_CHUNK_SIZE):
+    """Lê o arquivo de códigos em blocos de linhas (memória limitada)"""
+    with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                break
+            yield parse_scan_codes("".join(lines))
+
+
+def run_check_command(args):
+    """Concilia um log de códigos com o catálogo, sem Streamlit"""
+    entry = get_cached_catalog(open_catalog_source(args.catalog))
+    if entry['missing_columns']:
+        print(f"Colunas obrigatórias não encontradas: {entry['missing_columns']}",
+              file=sys.stderr)
+        return 2
+    for issue in entry['issues']:
+        print(f"⚠️ {issue}", file=sys.stderr)
+
+    df = entry['df']
+    # Contadores compartilhados entre os blocos: uma repetição em outro
+    # bloco também é tratada como duplicada
+    counters = new_scan_counters()
+
+    def classified_chunks():
+        for codes in iter_scan_chunks(args.scans, args.chunk_size):
+            results = classify_scans(df, codes, args.avanco)
+            records = apply_duplicate_policy(
+                results.to_dict('records'), counters, args.duplicados)
+            for record in records:
+                update_scan_counters(counters, record)
+            yield pd.DataFrame(records, columns=HISTORY_COLUMNS)
+
+    if args.out:
+        if xlsxwriter is None:
+            print("xlsxwriter não instalado: relatório indisponível",
+                  file=sys.stderr)
+            return 1
+        write_report_stream(args.out, df, classified_chunks())
+    else:
+        for _ in classified_chunks():
+            pass
+
+    total_avanco = len(entry['avanco_partition'].get(args.avanco, ()))
+    print(f"Catálogo: {len(df)} materiais ({total_avanco} com avanço '{args.avanco}')")
+    status_counts = counters['status']
+    print(f"Encontrados: {status_counts['found']}")
+    print(f"Avanço incorreto: {status_counts['wrong_avanco']}")
+    print(f"Não encontrados: {status_counts['not_found']}")
+    print(f"Duplicados: {status_counts['duplicate']}")
+    print(f"Faltantes: "
+          f"{total_avanco - len(counters['confirmed'].get(args.avanco, ()))}")
+    if args.out:
+        print(f"Relatório: {args.out}")
+    return 0
+
+
+# Serviço de ingestão de leituras via HTTP (scanners fixos ou em rede)
+INGEST_FLUSH_INTERVAL = 0.05
+INGEST_MAX_BATCH = 500
+INGEST_MAX_BODY = 1024 * 1024
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+                405: "Method Not Allowed", 413: "Payload Too Large"}
+
+
+def parse_ingest_payload(payload):
+    """Extrai códigos (e avanço opcional) de um corpo JSON de leituras"""
+    avanco = None
+    if isinstance(payload, dict):
+        avanco = payload.get('avanco')
+        codes = payload.get('codes', payload.get('id_codigo', []))
+    else:
+        codes = payload
+    if isinstance(codes, (str, int)):
+        codes = [codes]
+    if not isinstance(codes, list):
+        raise ValueError("formato de leitura inválido")
+    return [str(code).strip() for code in codes if str(code).strip()], avanco
+
+
+class ScanIngestServer:
+    """Servidor HTTP asyncio que aplica as regras de checagem e grava no histórico
+
+    As leituras são classificadas na hora (índice em memória) e gravadas
+    em lotes por uma tarefa separada, sem bloquear o loop de eventos.
+    """
+
+    def __init__(self, df, avanco, backend, station_id,
+                 duplicate_policy=DEFAULT_DUPLICATE_POLICY):
+        self.df = df
+        self.id_index = build_id_index(df)
+        self.avanco = avanco
+        self.backend = backend
+        self.station_id = station_id
+        self.session_id = uuid.uuid4().hex
+        self.duplicate_policy = duplicate_policy
+        # Materiais já confirmados por esta estação (detecção de duplicados)
+        cached = backend.load(station_id=station_id)
+        self.counters = rebuild_scan_counters(cached['history'] if cached else [])
+        self._queue = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def classify(self, codes, avanco=None):
+        """Mesmas regras do process_scan para cada código recebido"""
+        check_time = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        return [match_scan(self.df, self.id_index, code,
+                           avanco or self.avanco, check_time)
+                for code in codes]
+
+    def _persist(self, records):
+        """Grava um lote no backend de histórico (thread de escrita)"""
+        with perf_span('persist_batch'):
+            self.backend.append(records, station_id=self.station_id,
+                                session_id=self.session_id)
+        for record in records:
+            log_material_check(record['id_codigo'], record['avanco'],
+                               record['encontrado'] == 'Sim', self.station_id,
+                               result=record['encontrado'])
+
+    async def _writer(self):
+        """Agrupa as leituras pendentes e grava em lote"""
+        loop = asyncio.get_running_loop()
+        stop = False
+        while not stop:
+            record = await self._queue.get()
+            if record is None:
+                break
+            batch = [record]
+            deadline = loop.time() + INGEST_FLUSH_INTERVAL
+            while len(batch) < INGEST_MAX_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is None:
+                    # Sentinela do encerramento: grava o lote atual e sai
+                    stop = True
+                    break
+                batch.append(record)
+            await loop.run_in_executor(self._executor, self._persist, batch)
+
+    def _flush_pending(self):
+        """Grava o que ainda estiver na fila (encerramento)"""
+        pending = []
+        while not self._queue.empty():
+            record = self._queue.get_nowait()
+            if record is not None:
+                pending.append(record)
+        if pending:
+            self._persist(pending)
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def _route(self, method, path, body):
+        """Trata uma requisição e devolve (status, resposta)"""
+        path = path.split('?', 1)[0]
+        if path == '/health':
+            return 200, {'status': 'ok', 'materiais': len(self.df),
+                         'avanco': self.avanco, 'estacao': self.station_id}
+        if path not in ('/scan', '/scans'):
+            return 404, {'erro': 'rota não encontrada'}
+        if method != 'POST':
+            return 405, {'erro': 'use POST'}
+
+        try:
+            codes, avanco = parse_ingest_payload(json.loads(body or b'null'))
+        except (ValueError, TypeError) as e:
+            return 400, {'erro': f'JSON inválido: {str(e)}'}
+
+        with perf_span('ingest_scans'):
+            records = apply_duplicate_policy(self.classify(codes, avanco),
+                                             self.counters, self.duplicate_policy)
+            for record in records:
+                update_scan_counters(self.counters, record)
+                self._queue.put_nowait(record)
+        return 200, {'results': records}
+
+    async def handle_connection(self, reader, writer):
+        """Conexão HTTP/1.1 com keep-alive"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                lines = head.decode('latin-1').split("\r\n")
+                try:
+                    method, path, version = lines[0].split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get('connection', '').lower() != 'close' \
+                    and version.strip() == 'HTTP/1.1'
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400,
+                                        {'erro': 'Content-Length inválido'},
+                                        False)
+                    break
+                if length > INGEST_MAX_BODY:
+                    await self._respond(writer, 413,
+                                        {'erro': 'corpo muito grande'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self._route(method, path, body)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """Inicia o servidor e a tarefa de gravação em lote"""
+        self._queue = asyncio.Queue()
+        writer_task = asyncio.create_task(self._writer())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Ingestão de leituras em http://{host}:{port}/scan "
+              f"(avanço '{self.avanco}', estação '{self.station_id}', "
+              f"histórico '{self.backend.name}')")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            # Leituras já respondidas com 200 não podem se perder: o writer
+            # esvazia a fila até a sentinela em vez de ser cancelado
+            self._queue.put_nowait(None)
+            try:
+                await writer_task
+            finally:
+                self._executor.shutdown(wait=True)
+                self._flush_pending()
+
+
+def run_serve_command(args):
+    """Sobe o serviço HTTP de ingestão de leituras"""
+    entry = get_cached_catalog(open_catalog_source(args.catalog))
+    if entry['missing_columns']:
+        print(f"Colunas obrigatórias não encontradas: {entry['missing_columns']}",
+              file=sys.stderr)
+        return 2
+    for issue in entry['issues']:
+        print(f"⚠️ {issue}", file=sys.stderr)
+
+    backend = get_history_backend()
+    if backend.name != 'sqlite':
+        print("Aviso: use MATERIAL_CHECKER_BACKEND=sqlite para compartilhar "
+              "o histórico com a interface", file=sys.stderr)
+
+    setup_logging()
+    start_metrics_exporter()
+    server = ScanIngestServer(entry['df'], args.avanco, backend, args.station,
+                              args.duplicados)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def run_labels_command(args):
+    """Gera o PDF de etiquetas de um catálogo, sem Streamlit"""
+    entry = get_cached_catalog(open_catalog_source(args.catalog))
+    if entry['missing_columns']:
+        print(f"Colunas obrigatórias não encontradas: {entry['missing_columns']}",
+              file=sys.stderr)
+        return 2
+
+    df = filter_label_rows(entry['df'], args.etapa, args.avanco)
+    if df.empty:
+        print("Nenhum material para as etapas/avanço informados",
+              file=sys.stderr)
+        return 1
+    count = write_label_pdf(args.out, df)
+    print(f"{count} etiquetas gravadas em {args.out}")
+    return 0
+
+
+def build_cli_parser():
+    """Argumentos da linha de comando"""
+    parser = argparse.ArgumentParser(
+        prog="sistema.py",
+        description="Material Checker Pro - execução sem interface")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    check = subparsers.add_parser(
+        "check", help="Conciliar um arquivo de códigos com o catálogo")
+    check.add_argument("--catalog", required=True,
+                       help="Catálogo (xlsx, xls, csv, parquet ou feather)")
+    check.add_argument("--scans", required=True,
+                       help="Arquivo com um código por linha (txt/csv)")
+    check.add_argument("--avanco", required=True,
+                       help="Avanço esperado para os materiais")
+    check.add_argument("--out", help="Relatório xlsx de saída")
+    check.add_argument("--chunk-size", type=int, default=CLI_CHUNK_SIZE,
+                       help="Linhas lidas por bloco")
+    check.add_argument("--duplicados", choices=list(DUPLICATE_POLICIES),
+                       default=DEFAULT_DUPLICATE_POLICY,
+                       help="Como tratar leituras repetidas")
+    check.set_defaults(handler=run_check_command)
+
+    labels = subparsers.add_parser(
+        "labels", help="Gerar PDF de etiquetas com código de barras")
+    labels.add_argument("--catalog", required=True,
+                        help="Catálogo (xlsx, xls, csv, parquet ou feather)")
+    labels.add_argument("--out", required=True, help="PDF de saída")
+    labels.add_argument("--etapa", action="append",
+                        help="Etapa a imprimir (pode repetir; padrão: todas)")
+    labels.add_argument("--avanco", help="Só materiais com este avanço")
+    labels.set_defaults(handler=run_labels_command)
+
+    serve = subparsers.add_parser(
+        "serve", help="Serviço HTTP local para receber leituras de scanners")
+    serve.add_argument("--catalog", required=True,
+                       help="Catálogo (xlsx, xls, csv, parquet ou feather)")
+    serve.add_argument("--avanco", required=True,
+                       help="Avanço esperado (padrão das leituras)")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--station", default=DEFAULT_STATION_ID,
+                       help="Estação registrada no histórico")
+    serve.add_argument("--duplicados", choices=list(DUPLICATE_POLICIES),
+                       default=DEFAULT_DUPLICATE_POLICY,
+                       help="Como tratar leituras repetidas")
+    serve.set_defaults(handler=run_serve_command)
+    return parser
+
+
+def run_cli(argv):
+    """Ponto de entrada da linha de comando"""
+    args = build_cli_parser().parse_args(argv)
+    return args.handler(args)
+
+
+CLI_COMMANDS = {"check", "serve", "labels"}
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(run_cli(sys.argv[1:]))
     main()